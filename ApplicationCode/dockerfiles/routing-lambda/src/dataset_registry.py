@@ -0,0 +1,140 @@
+#  Copyright Amazon.com, Inc. and its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT
+#
+#  Licensed under the MIT License. See the LICENSE accompanying this file
+#  for the specific language governing permissions and limitations under
+#  the License.
+
+import os
+import time
+import random
+import logging
+import threading
+
+import boto3
+
+logger = logging.getLogger()
+
+MAX_BATCH_GET_ITEMS = 100
+
+
+class DatasetRegistry:
+    def __init__(self, table_name, ttl=None, negative_ttl=None, dynamodb_resource=None, max_attempts=5):
+        """
+        TTL cache of team-dataset name to pipeline, backed by the octagon Datasets table
+        :param table_name: name of the octagon Datasets table
+        :param ttl: seconds a resolved pipeline stays cached, DATASET_CACHE_TTL (default 300) if None
+        :param negative_ttl: seconds an unknown dataset stays cached, DATASET_NEGATIVE_CACHE_TTL (default 60) if None
+        :param dynamodb_resource: boto3 dynamodb resource, a new one if None
+        :param max_attempts: BatchGetItem attempts before unprocessed keys are given up on
+        """
+        self.table_name = table_name
+        self.ttl = float(os.getenv('DATASET_CACHE_TTL', 300)) if ttl is None else ttl
+        self.negative_ttl = float(os.getenv('DATASET_NEGATIVE_CACHE_TTL', 60)) if negative_ttl is None else negative_ttl
+        self.max_attempts = max_attempts
+        self._dynamodb = dynamodb_resource or boto3.resource('dynamodb')
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _get_cached(self, name):
+        entry = self._entries.get(name)
+        if entry is None or entry[1] <= time.monotonic():
+            return False, None
+        return True, entry[0]
+
+    def _put(self, name, pipeline):
+        ttl = self.ttl if pipeline is not None else self.negative_ttl
+        self._entries[name] = (pipeline, time.monotonic() + ttl)
+
+    def _batch_get(self, names):
+        """Looks names up with BatchGetItem
+
+        :return dict of name to pipeline for the names found in the table, and the set of names that
+            could not be looked up (request errors or keys still unprocessed after max_attempts)
+        """
+        pipelines = {}
+        unresolved = set()
+        for i in range(0, len(names), MAX_BATCH_GET_ITEMS):
+            chunk = names[i:i + MAX_BATCH_GET_ITEMS]
+            request = {
+                self.table_name: {
+                    'Keys': [{'name': name} for name in chunk],
+                    'ProjectionExpression': '#n, pipeline',
+                    'ExpressionAttributeNames': {'#n': 'name'}
+                }
+            }
+            attempt = 0
+            while request:
+                try:
+                    response = self._dynamodb.batch_get_item(RequestItems=request)
+                except Exception:
+                    logger.error('Unable to resolve datasets', exc_info=True)
+                    unresolved.update(key['name'] for key in request[self.table_name]['Keys'])
+                    break
+                for item in response['Responses'].get(self.table_name, []):
+                    pipelines[item['name']] = item['pipeline']
+                request = response.get('UnprocessedKeys')
+                if request:
+                    attempt += 1
+                    if attempt >= self.max_attempts:
+                        logger.error('Datasets unprocessed after {} attempts'.format(attempt))
+                        unresolved.update(key['name'] for key in request[self.table_name]['Keys'])
+                        break
+                    time.sleep(random.uniform(0, min(1.0, 0.05 * 2 ** attempt)))
+        return pipelines, unresolved
+
+    def resolve(self, names):
+        """Looks up the pipeline of team-dataset names
+
+        Names missing from the cache are all resolved with one BatchGetItem call.
+        :return dict of name to pipeline, None for datasets that are not registered, and the set
+            of names that could not be looked up, which are left out of the dict and not cached
+        """
+        names = list(dict.fromkeys(names))
+        result = {}
+        missing = []
+        with self._lock:
+            for name in names:
+                found, pipeline = self._get_cached(name)
+                if found:
+                    self.hits += 1
+                    result[name] = pipeline
+                else:
+                    self.misses += 1
+                    missing.append(name)
+        unresolved = set()
+        if missing:
+            logger.info('Resolving datasets: {}'.format(missing))
+            pipelines, unresolved = self._batch_get(missing)
+            with self._lock:
+                for name in missing:
+                    if name not in unresolved:
+                        self._put(name, pipelines.get(name))
+                        result[name] = pipelines.get(name)
+        return result, unresolved
+
+    def get_pipeline(self, team, dataset):
+        name = '{}-{}'.format(team, dataset)
+        pipelines, unresolved = self.resolve([name])
+        if unresolved:
+            raise RuntimeError('Unable to resolve dataset {}'.format(name))
+        return pipelines[name]
+
+    def invalidate(self, name=None):
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
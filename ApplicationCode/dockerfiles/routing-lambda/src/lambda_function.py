@@ -9,18 +9,28 @@ import os
 import json
 import logging
 import uuid
+import time
 import decimal
+import threading
 from urllib.parse import unquote_plus
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 from boto3.dynamodb.conditions import Key, Attr
 from botocore.exceptions import ClientError
 
+from dataset_registry import DatasetRegistry
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-sqs = boto3.resource('sqs')
+sqs = boto3.client('sqs')
 dynamodb = boto3.resource("dynamodb")
-dataset_table = dynamodb.Table('octagon-Datasets-{}'.format(os.environ['ENV']))
+dataset_registry = DatasetRegistry('octagon-Datasets-{}'.format(os.environ['ENV']), dynamodb_resource=dynamodb)
+# Queue URLs resolved once per warm container
+queue_urls = {}
+MAX_BATCH_SIZE = 10
+# Destination queues sent to concurrently, 1 keeps the sequential behaviour
+MAX_WORKERS = int(os.getenv('MAX_WORKERS', 1))
 
 
 # Helper class to convert a DynamoDB item to JSON.
@@ -34,18 +44,54 @@ class DecimalEncoder(json.JSONEncoder):
         return super(DecimalEncoder, self).default(o)
 
 
-def get_item(table, team, dataset):
+def get_queue_name(team, pipeline):
+    return '{}-{}-{}-{}-{}-{}-queue-a.fifo'.format(
+        'sdlf',
+        team,
+        pipeline,
+        os.environ['ORG'],
+        os.environ['APP'],
+        os.environ['ENV']
+    )
+
+
+def get_queue_url(queue_name):
+    if queue_name not in queue_urls:
+        queue_urls[queue_name] = sqs.get_queue_url(QueueName=queue_name)['QueueUrl']
+    return queue_urls[queue_name]
+
+
+def send_messages(queue_name, messages):
+    """Sends (record_id, body, group_id) messages to a FIFO queue with SendMessageBatch, 10 per call
+
+    Returns the record_ids of the messages that could not be sent.
+    """
+    failed = []
     try:
-        response = table.get_item(
-            Key={
-                'name': '{}-{}'.format(team, dataset)
-            }
-        )
-    except ClientError as e:
-        print(e.response['Error']['Message'])
-    else:
-        item = response['Item']
-        return item['pipeline']
+        queue_url = get_queue_url(queue_name)
+    except ClientError:
+        logger.error('Unable to resolve queue {}'.format(queue_name), exc_info=True)
+        return [record_id for record_id, _, _ in messages]
+    for x in range(0, len(messages), MAX_BATCH_SIZE):
+        chunk = messages[x:x + MAX_BATCH_SIZE]
+        entries = [{
+            'Id': str(i),
+            'MessageBody': body,
+            'MessageGroupId': group_id,
+            'MessageDeduplicationId': str(uuid.uuid1())
+        } for i, (_, body, group_id) in enumerate(chunk)]
+        try:
+            response = sqs.send_message_batch(QueueUrl=queue_url, Entries=entries)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'AWS.SimpleQueueService.NonExistentQueue':
+                queue_urls.pop(queue_name, None)
+            logger.error('Failed to send messages to {}'.format(queue_name), exc_info=True)
+            failed.extend(record_id for record_id, _, _ in chunk)
+            continue
+        for entry in response.get('Failed', []):
+            logger.error('Failed to send message to {}: {}'.format(queue_name, entry))
+            failed.append(chunk[int(entry['Id'])][0])
+    return failed
 
 
 def parse_s3_event(s3_event):
@@ -58,62 +104,101 @@ def parse_s3_event(s3_event):
     }
 
 
+def get_team_dataset_partition(key):
+    partition = None
+    if os.environ['NUM_BUCKETS'] == '1':
+        team = key.split('/')[1]
+        dataset = key.split('/')[2]
+    elif len(key.split('/')) == 5:
+        team = key.split('/')[0]
+        dataset = key.split('/')[1] + '-' + key.split('/')[2]
+        partition = key.split('/')[-2]
+    else:
+        team = key.split('/')[0]
+        dataset = key.split('/')[1]
+        partition = key.split('/')[-2]
+    return team, dataset, partition
+
+
 def lambda_handler(event, context):
-    try:
-        print(json.dumps(event))
-        logger.info('Received {} messages'.format(len(event['Records'])))
-        for record in event['Records']:
+    """Routes S3 events to their pipeline queue
+
+    Failed records are reported in batchItemFailures so SQS only redelivers those.
+    """
+    print(json.dumps(event))
+    logger.info('Received {} messages'.format(len(event['Records'])))
+    failed = []
+    messages = []
+    for record in event['Records']:
+        try:
             logger.info('Parsing S3 Event')
             message = parse_s3_event(json.loads(record['body'])['Records'][0])
+            message['team'], message['dataset'], message['partition'] = get_team_dataset_partition(message['key'])
+            messages.append((record['messageId'], message))
+        except Exception:
+            logger.error('Unable to parse message {}'.format(record['messageId']), exc_info=True)
+            failed.append(record['messageId'])
 
-            if os.environ['NUM_BUCKETS'] == '1':
-                team = message['key'].split('/')[1]
-                dataset = message['key'].split('/')[2]
-            elif len(message['key'].split('/')) == 5:
-                team = message['key'].split('/')[0]
-                dataset = message['key'].split(
-                    '/')[1] + '-' + message['key'].split('/')[2]
-                partition = message['key'].split('/')[-2]
-            else:
-                team = message['key'].split('/')[0]
-                dataset = message['key'].split('/')[1]
-                partition = message['key'].split('/')[-2]
-            message['team'] = team
-            message['dataset'] = dataset
-            pipeline = get_item(dataset_table, team, dataset)
-            message['pipeline'] = pipeline
-            message['partition'] = partition
-            runtime_region = os.environ['AWS_REGION']
-            print(runtime_region)
-            logger.info(
-                'Sending event to {}-{} pipeline queue for processing'.format(team, pipeline))
-            a = '{}-{}-{}-{}-{}-{}-queue-a.fifo'.format(
-                'sdlf',
-                team,
-                pipeline,
-                os.environ['ORG'],
-                os.environ['APP'],
-                os.environ['ENV']
-                # team,
-                # pipeline
-            )
-            print(a)
-            queue = sqs.get_queue_by_name(QueueName='{}-{}-{}-{}-{}-{}-queue-a.fifo'.format(
-                'sdlf',
-                team,
-                pipeline,
-                os.environ['ORG'],
-                os.environ['APP'],
-                os.environ['ENV']
-                # team,
-                # pipeline
-            ))
-            print(queue)
-            runtime_region = os.environ['AWS_REGION']
-            print(runtime_region)
-            queue.send_message(MessageBody=json.dumps(
-                message), MessageGroupId='{}-{}'.format(team, dataset), MessageDeduplicationId=str(uuid.uuid1()))
-    except Exception as e:
-        logger.error("Fatal error", exc_info=True)
-        raise e
-    return
+    pipelines, unresolved = dataset_registry.resolve(
+        ['{}-{}'.format(m['team'], m['dataset']) for _, m in messages])
+    logger.info('Dataset registry stats: {}'.format(json.dumps(dataset_registry.stats())))
+
+    queue_messages = {}
+    for record_id, message in messages:
+        team = message['team']
+        dataset = message['dataset']
+        name = '{}-{}'.format(team, dataset)
+        if name in unresolved:
+            logger.error('Dataset {} could not be looked up'.format(name))
+            failed.append(record_id)
+            continue
+        pipeline = pipelines[name]
+        if pipeline is None:
+            logger.error('Dataset {} is not registered'.format(name))
+            failed.append(record_id)
+            continue
+        message['pipeline'] = pipeline
+        logger.info(
+            'Sending event to {}-{} pipeline queue for processing'.format(team, pipeline))
+        queue_messages.setdefault(get_queue_name(team, pipeline), []).append(
+            (record_id, json.dumps(message), '{}-{}'.format(team, dataset)))
+    # A message group always maps to a single queue, whose batches are sent in order
+    metrics = {'in_flight': 0, 'peak_concurrency': 0, 'send_latencies': []}
+    lock = threading.Lock()
+
+    def send_queue_messages(item):
+        queue_name, queued = item
+        with lock:
+            metrics['in_flight'] += 1
+            metrics['peak_concurrency'] = max(metrics['peak_concurrency'], metrics['in_flight'])
+        start = time.monotonic()
+        try:
+            return send_messages(queue_name, queued)
+        finally:
+            latency = time.monotonic() - start
+            logger.info('Sent {} messages to {} in {:.3f}s'.format(len(queued), queue_name, latency))
+            with lock:
+                metrics['in_flight'] -= 1
+                metrics['send_latencies'].append(latency)
+
+    if MAX_WORKERS <= 1 or len(queue_messages) <= 1:
+        results = [send_queue_messages(item) for item in queue_messages.items()]
+    else:
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(queue_messages))) as executor:
+            results = list(executor.map(send_queue_messages, queue_messages.items()))
+    for queue_failed in results:
+        failed.extend(queue_failed)
+    # One sample per destination queue: the time to send all of its messages
+    latencies = metrics['send_latencies']
+    logger.info('Batch metrics: {}'.format(json.dumps({
+        'records': len(event['Records']),
+        'queues': len(queue_messages),
+        'workers': MAX_WORKERS,
+        'peak_concurrency': metrics['peak_concurrency'],
+        'queue_send_latency_avg': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        'queue_send_latency_max': round(max(latencies), 3) if latencies else 0.0
+    })))
+
+    if failed:
+        logger.error('{} of {} messages failed'.format(len(failed), len(event['Records'])))
+    return {'batchItemFailures': [{'itemIdentifier': record_id} for record_id in failed]}
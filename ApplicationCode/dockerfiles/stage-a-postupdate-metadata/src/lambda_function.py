@@ -44,19 +44,18 @@ def lambda_handler(event, context):
         logger.info('Initializing DynamoDB config and Interface')
         dynamo_config = DynamoConfiguration()
         dynamo_interface = DynamoInterface(dynamo_config)
+        stage_bucket = S3Configuration().stage_bucket
 
         logger.info('Storing metadata to DynamoDB')
-        for key in processed_keys:
-            object_metadata = {
-                'bucket': S3Configuration().stage_bucket,
-                'key': key,
-                'team': team,
-                'pipeline': pipeline,
-                'dataset': dataset,
-                'stage': 'pre-stage'
-            }
-            
-            dynamo_interface.update_object_metadata_catalog(object_metadata)
+        objects_metadata = [{
+            'bucket': stage_bucket,
+            'key': key,
+            'team': team,
+            'pipeline': pipeline,
+            'dataset': dataset,
+            'stage': 'pre-stage'
+        } for key in processed_keys]
+        dynamo_interface.batch_update_object_metadata_catalog(objects_metadata)
 
         logger.info('Sending messages to next SQS queue if it exists')
         sqs_config = SQSConfiguration(team, pipeline, dataset)
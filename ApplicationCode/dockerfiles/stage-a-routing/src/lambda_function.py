@@ -5,24 +5,71 @@
 #  for the specific language governing permissions and limitations under
 #  the License.
 
+import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 
-from datalake_library.commons import init_logger
+import boto3
+
+from datalake_library.commons import init_logger, process_sqs_records, RecordMetrics
 from datalake_library.configuration.resource_configs import StateMachineConfiguration
 from datalake_library.interfaces.states_interface import StatesInterface
 
 logger = init_logger(__name__)
+# Message groups processed concurrently, 1 keeps the sequential behaviour
+MAX_WORKERS = int(os.getenv('MAX_WORKERS', 1))
+# Clients are shared by every record and reused across warm invocations
+ssm = boto3.client('ssm')
+states = StatesInterface()
+
+
+def resolve_state_machine_arns(pipelines):
+    """Resolves the pre-stage state machine ARN of each (team, pipeline), an exception when it fails"""
+    def resolve(team_pipeline):
+        try:
+            return StateMachineConfiguration(*team_pipeline, ssm_interface=ssm).get_pre_stage_state_machine_arn
+        except Exception as e:
+            logger.error('Unable to resolve state machine of {}-{}'.format(*team_pipeline), exc_info=True)
+            return e
+
+    if MAX_WORKERS <= 1 or len(pipelines) <= 1:
+        return {team_pipeline: resolve(team_pipeline) for team_pipeline in pipelines}
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(pipelines))) as executor:
+        return dict(zip(pipelines, executor.map(resolve, pipelines)))
 
 
 def lambda_handler(event, context):
-    try:
-        logger.info('Received {} messages'.format(len(event['Records'])))
-        for record in event['Records']:
-            logger.info('Starting State Machine Execution')
-            state_config = StateMachineConfiguration(json.loads(record['body'])['team'],
-                                                     json.loads(record['body'])['pipeline'])
-            StatesInterface().run_state_machine(state_config.get_pre_stage_state_machine_arn, record['body'])
-    except Exception as e:
-        logger.error("Fatal error", exc_info=True)
-        raise e
-    return
+    """Starts the pre-stage state machine for each message
+
+    Failed records are reported in batchItemFailures so SQS only redelivers those. Records
+    following a failure in the same message group are reported too, to keep FIFO ordering.
+    """
+    logger.info('Received {} messages'.format(len(event['Records'])))
+    team_pipelines = {}
+    for record in event['Records']:
+        try:
+            body = json.loads(record['body'])
+            team_pipelines[record['messageId']] = (body['team'], body['pipeline'])
+        except Exception as e:
+            logger.error('Unable to parse message {}'.format(record['messageId']), exc_info=True)
+            team_pipelines[record['messageId']] = e
+    arns = resolve_state_machine_arns(
+        list(dict.fromkeys(t for t in team_pipelines.values() if not isinstance(t, Exception))))
+
+    def start_execution(record):
+        team_pipeline = team_pipelines[record['messageId']]
+        if isinstance(team_pipeline, Exception):
+            raise team_pipeline
+        arn = arns[team_pipeline]
+        if isinstance(arn, Exception):
+            raise arn
+        logger.info('Starting State Machine Execution')
+        states.run_state_machine(arn, record['body'])
+
+    metrics = RecordMetrics()
+    failed = process_sqs_records(event['Records'], start_execution, MAX_WORKERS, metrics, logger)
+    logger.info('Batch metrics: {}'.format(json.dumps(dict(metrics.summary(), workers=MAX_WORKERS,
+                                                           pipelines=len(arns)))))
+    if failed:
+        logger.error('{} of {} messages failed'.format(len(failed), len(event['Records'])))
+    return {'batchItemFailures': [{'itemIdentifier': record_id} for record_id in failed]}
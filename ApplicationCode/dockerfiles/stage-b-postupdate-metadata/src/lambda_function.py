@@ -38,7 +38,7 @@ def lambda_handler(event, context):
 
         bucket = event['body']['bucket']
         processed_keys_path = event['body']['job']['processedKeysPath']
-        processed_keys = S3Interface().list_objects(bucket, processed_keys_path)
+        processed_keys = S3Interface().list_objects(bucket, processed_keys_path, parallel=True)
         team = event['body']['team']
         pipeline = event['body']['pipeline']
         dataset = event['body']['dataset']
@@ -48,16 +48,15 @@ def lambda_handler(event, context):
         dynamo_interface = DynamoInterface(dynamo_config)
 
         logger.info('Storing metadata to DynamoDB')
-        for key in processed_keys:
-            object_metadata = {
-                'bucket': bucket,
-                'key': key,
-                'team': team,
-                'pipeline': pipeline,
-                'dataset': dataset,
-                'stage': 'post-stage'
-            }
-            dynamo_interface.update_object_metadata_catalog(object_metadata)
+        objects_metadata = [{
+            'bucket': bucket,
+            'key': key,
+            'team': team,
+            'pipeline': pipeline,
+            'dataset': dataset,
+            'stage': 'post-stage'
+        } for key in processed_keys]
+        dynamo_interface.batch_update_object_metadata_catalog(objects_metadata, max_workers=4)
         
         octagon_client.end_pipeline_execution_success()
     except Exception as e:
@@ -1,4 +1,9 @@
+import time
 import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 
 def init_logger(file_name, log_level=None):
@@ -8,3 +13,175 @@ def init_logger(file_name, log_level=None):
     logger = logging.getLogger(file_name)
     logger.setLevel(getattr(logging, log_level))
     return logger
+
+
+class TTLCache:
+    def __init__(self, default_ttl=300, max_entries=None):
+        """
+        Thread-safe TTL cache with an optional LRU bound
+        :param default_ttl: seconds an entry stays valid when no per-key ttl is given
+        :param max_entries: least recently used entries are evicted beyond this size, unbounded if None
+        """
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        self._key_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _is_fresh(self, entry):
+        expires_at = entry[1]
+        return expires_at is None or expires_at > time.monotonic()
+
+    def get(self, key):
+        """Returns the cached value of key, or None when it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_fresh(entry):
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, ttl=None):
+        """Stores value under key for ttl seconds (default_ttl if None, forever if ttl <= 0)"""
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl > 0 else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            if self.max_entries is not None:
+                while len(self._entries) > self.max_entries:
+                    evicted, _ = self._entries.popitem(last=False)
+                    self._key_locks.pop(evicted, None)
+
+    def get_or_load(self, key, loader, ttl=None):
+        """Returns the cached value of key, calling loader(key) once on a miss
+
+        Concurrent misses on the same key wait for the first loader instead of all loading it.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and self._is_fresh(entry):
+                    return entry[0]
+            value = loader(key)
+            self.put(key, value, ttl)
+        return value
+
+    def invalidate(self, key=None, prefix=None):
+        """Drops a single key, every key under prefix, or the whole cache when neither is given"""
+        with self._lock:
+            if key is not None:
+                self._entries.pop(key, None)
+            elif prefix is not None:
+                for cached_key in [k for k in self._entries if k.startswith(prefix)]:
+                    del self._entries[cached_key]
+            else:
+                self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+class RecordMetrics:
+    def __init__(self):
+        """Latency and concurrency of the records processed in one batch"""
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self.in_flight = 0
+        self.peak_concurrency = 0
+        self.latencies = []
+
+    @contextmanager
+    def track(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_concurrency = max(self.peak_concurrency, self.in_flight)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.latencies.append(time.monotonic() - start)
+
+    def summary(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            return {
+                'records': len(latencies),
+                'duration': round(time.monotonic() - self._started, 3),
+                'peak_concurrency': self.peak_concurrency,
+                'latency_avg': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+                'latency_p50': round(latencies[len(latencies) // 2], 3) if latencies else 0.0,
+                'latency_max': round(latencies[-1], 3) if latencies else 0.0
+            }
+
+
+def group_sqs_records(records):
+    """Groups SQS records by MessageGroupId keeping their order, records without one get their own group"""
+    groups = OrderedDict()
+    for record in records:
+        group_id = record.get('attributes', {}).get('MessageGroupId') or record['messageId']
+        groups.setdefault(group_id, []).append(record)
+    return list(groups.values())
+
+
+def process_sqs_records(records, process_record, max_workers=1, metrics=None, logger=None):
+    """Calls process_record on every SQS record and returns the messageIds that failed
+
+    Records of a message group are processed in order and, once one fails, the rest of the
+    group is reported as failed too so FIFO ordering holds on redelivery. Different groups
+    run in parallel on up to max_workers threads.
+
+    :param records: event['Records'] of an SQS triggered Lambda
+    :param process_record: function called with each record, failures are signalled by raising
+    :param max_workers: number of message groups processed concurrently
+    :param metrics: RecordMetrics collecting per-record latency, a new one if None
+    :param logger: logger failed records are reported to
+    :return list of failed messageIds
+    """
+    metrics = metrics or RecordMetrics()
+    logger = logger or logging.getLogger(__name__)
+
+    def process_group(group):
+        failed = []
+        for record in group:
+            if failed:
+                failed.append(record['messageId'])
+                continue
+            try:
+                with metrics.track():
+                    process_record(record)
+            except Exception:
+                logger.error('Unable to process message {}'.format(record['messageId']), exc_info=True)
+                failed.append(record['messageId'])
+        return failed
+
+    groups = group_sqs_records(records)
+    if max_workers <= 1 or len(groups) <= 1:
+        results = [process_group(group) for group in groups]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(groups))) as executor:
+            results = list(executor.map(process_group, groups))
+    return [record_id for failed in results for record_id in failed]
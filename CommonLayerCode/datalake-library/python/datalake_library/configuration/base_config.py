@@ -1,9 +1,14 @@
 from botocore.exceptions import ClientError
 
+from .parameter_cache import parameter_cache
+from .snapshot import config_snapshot
+from .throttling import ssm_retry_policy
 from ..commons import init_logger
 
 
 class BaseConfig:
+    retry_policy = ssm_retry_policy
+
     def __init__(self, log_level, ssm_interface):
         self.log_level = log_level
         self._logger = init_logger(__name__, log_level)
@@ -22,9 +27,16 @@ class BaseConfig:
         raise NotImplementedError()
 
     def _get_ssm_param(self, key):
+        return parameter_cache.get_or_load(key, self._load_ssm_param)
+
+    def _load_ssm_param(self, key):
+        value = config_snapshot.get(key)
+        if value is not None:
+            self._logger.info('Obtaining SSM Parameter from snapshot: {}'.format(key))
+            return value
         try:
             self._logger.info('Obtaining SSM Parameter: {}'.format(key))
-            return self._ssm.get_parameter(Name=key)['Parameter']['Value']
+            return self.retry_policy.call(self._ssm.get_parameter, Name=key)['Parameter']['Value']
         except ClientError as e:
             if e.response['Error']['Code'] == 'ThrottlingException':
                 self._logger.error("SSM RATE LIMIT REACHED")
@@ -0,0 +1,88 @@
+import os
+
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+from .parameter_cache import parameter_cache
+from .throttling import ssm_retry_policy
+from ..commons import init_logger
+
+logger = init_logger(__name__, os.getenv('LOG_LEVEL', 'INFO'))
+
+GET_PARAMETERS_BATCH_SIZE = 10
+
+
+def fetch_parameters(paths=None, names=None, ssm_interface=None):
+    """Reads SSM parameters in bulk
+
+    :param paths: parameter hierarchies to read recursively, e.g. ['/DataLake/'] or ['/DataLake/SQS/engineering']
+    :param names: explicit parameter names to read with batched get_parameters calls
+    :param ssm_interface: ssm interface, normally boto, to read parameters from parameter store
+    :return dict of parameter name to value
+    """
+    ssm = ssm_interface or boto3.client('ssm')
+    parameters = {}
+    try:
+        for path in paths or []:
+            logger.info('Reading SSM Parameters under path: {}'.format(path))
+            kwargs = {'Path': path, 'Recursive': True}
+            while True:
+                page = ssm_retry_policy.call(ssm.get_parameters_by_path, **kwargs)
+                for parameter in page['Parameters']:
+                    parameters[parameter['Name']] = parameter['Value']
+                if not page.get('NextToken'):
+                    break
+                kwargs['NextToken'] = page['NextToken']
+        names = list(names or [])
+        for i in range(0, len(names), GET_PARAMETERS_BATCH_SIZE):
+            batch = names[i:i + GET_PARAMETERS_BATCH_SIZE]
+            logger.info('Reading SSM Parameters: {}'.format(batch))
+            response = ssm_retry_policy.call(ssm.get_parameters, Names=batch)
+            for parameter in response['Parameters']:
+                parameters[parameter['Name']] = parameter['Value']
+            if response.get('InvalidParameters'):
+                logger.warning('SSM Parameters not found: {}'.format(response['InvalidParameters']))
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ThrottlingException':
+            logger.error("SSM RATE LIMIT REACHED")
+        else:
+            logger.error("Unexpected error: %s" % e)
+        raise
+    return parameters
+
+
+def bootstrap_parameters(paths=None, names=None, ssm_interface=None, ttl=None, cache=None):
+    """Bulk loads SSM parameters into the shared parameter cache
+
+    Intended to run once during the Lambda init phase so configuration properties
+    are served from memory instead of one get_parameter call each.
+
+    :param paths: parameter hierarchies to load recursively, e.g. ['/DataLake/'] or ['/DataLake/SQS/engineering']
+    :param names: explicit parameter names to load with batched get_parameters calls
+    :param ssm_interface: ssm interface, normally boto, to read parameters from parameter store
+    :param ttl: seconds the loaded entries stay valid, cache default if None
+    :param cache: cache to populate, the process-wide parameter cache if None
+    :return number of parameters loaded
+    """
+    cache = cache or parameter_cache
+    parameters = fetch_parameters(paths, names, ssm_interface)
+    for name, value in parameters.items():
+        cache.put(name, value, ttl)
+    logger.info('Bootstrapped {} SSM Parameters'.format(len(parameters)))
+    return len(parameters)
+
+
+def bootstrap_from_environment(ssm_interface=None):
+    """Runs bootstrap_parameters when SSM_BOOTSTRAP_PATHS is set
+
+    SSM_BOOTSTRAP_PATHS is a comma separated list of parameter hierarchies, e.g. "/DataLake/".
+    Failures are logged and ignored: properties then fall back to individual lookups.
+    """
+    paths = [p.strip() for p in os.getenv('SSM_BOOTSTRAP_PATHS', '').split(',') if p.strip()]
+    if not paths:
+        return 0
+    try:
+        return bootstrap_parameters(paths=paths, ssm_interface=ssm_interface)
+    except (BotoCoreError, ClientError):
+        logger.warning('SSM bootstrap failed, falling back to lazy parameter lookups')
+        return 0
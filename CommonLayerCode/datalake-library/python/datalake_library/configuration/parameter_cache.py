@@ -0,0 +1,18 @@
+import os
+
+from ..commons import TTLCache
+
+
+class ParameterCache(TTLCache):
+    def __init__(self, default_ttl=None, max_entries=None):
+        """
+        Process-wide cache of SSM parameter values shared by every configuration class
+        :param default_ttl: seconds an entry stays valid when no per-key ttl is given, SSM_CACHE_TTL if None
+        :param max_entries: least recently used entries are evicted beyond this size, unbounded if None
+        """
+        if default_ttl is None:
+            default_ttl = float(os.getenv('SSM_CACHE_TTL', 300))
+        super().__init__(default_ttl, max_entries)
+
+
+parameter_cache = ParameterCache()
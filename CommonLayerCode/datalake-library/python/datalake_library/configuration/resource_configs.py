@@ -3,8 +3,12 @@ import os
 import boto3
 
 from .base_config import BaseConfig
+from .bootstrap import bootstrap_from_environment
 from ..commons import init_logger
 
+# Opt-in (SSM_BOOTSTRAP_PATHS) bulk load of parameters during the Lambda init phase
+bootstrap_from_environment()
+
 
 class S3Configuration(BaseConfig):
     def __init__(self, log_level=None, ssm_interface=None):
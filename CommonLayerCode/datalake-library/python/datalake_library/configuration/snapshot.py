@@ -0,0 +1,143 @@
+"""Offline snapshot of the SSM parameters read by the configuration classes
+
+The snapshot is generated at image build time and shipped in the common layer:
+
+    python -m datalake_library.configuration.snapshot --paths /DataLake/ --output ssm-snapshot.json
+
+BaseConfig reads parameters from it first and only falls back to SSM on a miss
+or when the snapshot is stale. Snapshots never go stale unless SSM_SNAPSHOT_MAX_AGE
+opts in to a maximum age in seconds since generation.
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .bootstrap import fetch_parameters
+from ..commons import init_logger
+
+logger = init_logger(__name__, os.getenv('LOG_LEVEL', 'INFO'))
+
+SNAPSHOT_VERSION = 1
+DEFAULT_SNAPSHOT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ssm-snapshot.json')
+DEFAULT_MAX_AGE = 0
+
+
+def compute_checksum(parameters):
+    canonical = json.dumps(parameters, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def build_snapshot(parameters, generated_at=None):
+    return {
+        'version': SNAPSHOT_VERSION,
+        'generated_at': int(generated_at if generated_at is not None else time.time()),
+        'checksum': compute_checksum(parameters),
+        'parameters': parameters
+    }
+
+
+def generate_snapshot(output_path, paths=None, names=None, ssm_interface=None):
+    """Resolves SSM parameters and writes them to a versioned snapshot file
+
+    :param output_path: path of the snapshot file to write
+    :param paths: parameter hierarchies to include, ['/DataLake/'] if neither paths nor names are given
+    :param names: explicit parameter names to include
+    :param ssm_interface: ssm interface, normally boto, to read parameters from parameter store
+    :return the snapshot written
+    """
+    if not paths and not names:
+        paths = ['/DataLake/']
+    snapshot = build_snapshot(fetch_parameters(paths, names, ssm_interface))
+    with open(output_path, 'w') as snapshot_file:
+        json.dump(snapshot, snapshot_file, indent=2, sort_keys=True)
+    logger.info('Wrote {} SSM Parameters to snapshot {}'.format(len(snapshot['parameters']), output_path))
+    return snapshot
+
+
+class ConfigSnapshot:
+    def __init__(self, path=None, max_age=None):
+        """
+        Read-only view of a snapshot file, loaded lazily on first lookup
+        :param path: snapshot file, SSM_SNAPSHOT_FILE or the file shipped with the library if None
+        :param max_age: seconds after generation the snapshot is considered stale, SSM_SNAPSHOT_MAX_AGE
+            (default 0, never) if None
+        """
+        self.path = path or os.getenv('SSM_SNAPSHOT_FILE', DEFAULT_SNAPSHOT_FILE)
+        if max_age is None:
+            max_age = float(os.getenv('SSM_SNAPSHOT_MAX_AGE', DEFAULT_MAX_AGE))
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._parameters = {}
+        self._generated_at = None
+        self._stale_warned = False
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not os.path.isfile(self.path):
+                return
+            try:
+                with open(self.path) as snapshot_file:
+                    snapshot = json.load(snapshot_file)
+            except (OSError, ValueError):
+                logger.warning('Unreadable SSM snapshot {}, ignoring it'.format(self.path))
+                return
+            if snapshot.get('version') != SNAPSHOT_VERSION:
+                logger.warning('Unsupported SSM snapshot version {}, ignoring it'.format(snapshot.get('version')))
+                return
+            parameters = snapshot.get('parameters', {})
+            if snapshot.get('checksum') != compute_checksum(parameters):
+                logger.warning('SSM snapshot checksum mismatch, ignoring it')
+                return
+            self._parameters = parameters
+            self._generated_at = snapshot.get('generated_at', 0)
+            logger.info('Loaded {} SSM Parameters from snapshot {}'.format(len(parameters), self.path))
+
+    @property
+    def is_stale(self):
+        self._load()
+        if self._generated_at is None:
+            return True
+        age = time.time() - self._generated_at
+        if self.max_age > 0 and age > self.max_age:
+            if not self._stale_warned:
+                self._stale_warned = True
+                logger.warning('SSM snapshot {} is {:.0f}s old, above SSM_SNAPSHOT_MAX_AGE={:.0f}s, '
+                               'reading parameters from SSM instead'.format(self.path, age, self.max_age))
+            return True
+        return False
+
+    def get(self, key):
+        """Returns the snapshot value of key, or None on a miss or when the snapshot is stale"""
+        if self.is_stale:
+            return None
+        return self._parameters.get(key)
+
+    def reload(self):
+        with self._lock:
+            self._loaded = False
+            self._parameters = {}
+            self._generated_at = None
+            self._stale_warned = False
+
+
+config_snapshot = ConfigSnapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate an offline snapshot of DataLake SSM parameters')
+    parser.add_argument('--paths', nargs='*', default=None, help='parameter hierarchies to include')
+    parser.add_argument('--names', nargs='*', default=None, help='explicit parameter names to include')
+    parser.add_argument('--output', default=DEFAULT_SNAPSHOT_FILE, help='snapshot file to write')
+    args = parser.parse_args()
+    generate_snapshot(args.output, args.paths, args.names)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import os
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from ..commons import init_logger
+
+logger = init_logger(__name__, os.getenv('LOG_LEVEL', 'INFO'))
+
+THROTTLING_ERROR_CODES = ('ThrottlingException', 'TooManyRequestsException', 'Throttling', 'RequestLimitExceeded')
+
+
+def backoff_delay(attempt, base=0.1, cap=5.0):
+    """Full-jitter exponential backoff: a random delay between 0 and min(cap, base * 2 ** attempt) seconds"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None, min_rate=None, clock=time.monotonic, sleep=time.sleep):
+        """
+        Adaptive token bucket shared by every caller in the process
+        :param rate: tokens added per second when no throttling is observed
+        :param capacity: maximum burst size, rate if None
+        :param min_rate: floor the rate is reduced to after repeated throttles, rate / 10 if None
+        :param clock: monotonic clock, injectable for tests
+        :param sleep: sleep function, injectable for tests
+        """
+        self.max_rate = float(rate)
+        self.min_rate = float(min_rate) if min_rate is not None else self.max_rate / 10
+        self.rate = self.max_rate
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._last_refill = clock()
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self, tokens=1):
+        """Blocks until tokens are available and returns the seconds waited"""
+        with self._lock:
+            self._refill()
+            # Tokens are reserved before sleeping, so the wait finishes in one step and
+            # concurrent callers queue up behind each other instead of re-checking a bucket
+            # that rounding may leave a hair short
+            delay = max(0.0, (tokens - self._tokens) / self.rate)
+            self._tokens -= tokens
+            if delay > 0:
+                self.waits += 1
+                self.wait_time += delay
+        if delay > 0:
+            self._sleep(delay)
+        return delay
+
+    def on_throttle(self):
+        """Halves the refill rate after the service throttled a request"""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def on_success(self):
+        """Recovers the refill rate additively after a successful request"""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class RetryPolicy:
+    def __init__(self, limiter=None, max_attempts=5, base_delay=0.1, max_delay=5.0, retry_budget=50,
+                 budget_refund=0.1, sleep=time.sleep):
+        """
+        Jittered exponential backoff for throttled calls, bounded by a process-wide retry budget
+        :param limiter: TokenBucket every attempt acquires a token from, no limiting if None
+        :param max_attempts: attempts per call, including the first one
+        :param base_delay: backoff base in seconds
+        :param max_delay: backoff cap in seconds
+        :param retry_budget: retries available to the process; each retry spends one, each success refunds budget_refund
+        :param budget_refund: budget given back per successful call
+        :param sleep: sleep function, injectable for tests
+        """
+        self.limiter = limiter
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_budget_capacity = float(retry_budget)
+        self.budget_refund = budget_refund
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._budget = self.retry_budget_capacity
+        self.calls = 0
+        self.throttles = 0
+        self.retries = 0
+        self.backoff_time = 0.0
+        self.budget_exhausted = 0
+
+    def _spend_retry(self):
+        with self._lock:
+            if self._budget < 1:
+                self.budget_exhausted += 1
+                return False
+            self._budget -= 1
+            self.retries += 1
+            return True
+
+    def _refund(self):
+        with self._lock:
+            self.calls += 1
+            self._budget = min(self.retry_budget_capacity, self._budget + self.budget_refund)
+
+    def call(self, fn, *args, **kwargs):
+        """Calls fn, retrying throttling errors with full-jitter exponential backoff"""
+        attempt = 0
+        while True:
+            if self.limiter:
+                self.limiter.acquire()
+            try:
+                response = fn(*args, **kwargs)
+            except ClientError as e:
+                if e.response['Error']['Code'] not in THROTTLING_ERROR_CODES:
+                    raise
+                with self._lock:
+                    self.throttles += 1
+                if self.limiter:
+                    self.limiter.on_throttle()
+                attempt += 1
+                if attempt >= self.max_attempts or not self._spend_retry():
+                    raise
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                logger.warning('Request throttled, retrying in {:.3f}s (attempt {})'.format(delay, attempt + 1))
+                with self._lock:
+                    self.backoff_time += delay
+                self._sleep(delay)
+                continue
+            if self.limiter:
+                self.limiter.on_success()
+            self._refund()
+            return response
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'calls': self.calls,
+                'throttles': self.throttles,
+                'retries': self.retries,
+                'backoff_time': self.backoff_time,
+                'budget_exhausted': self.budget_exhausted,
+                'retry_budget': self._budget
+            }
+        if self.limiter:
+            stats.update({
+                'waits': self.limiter.waits,
+                'wait_time': self.limiter.wait_time,
+                'rate': self.limiter.rate
+            })
+        return stats
+
+
+ssm_retry_policy = RetryPolicy(
+    limiter=TokenBucket(float(os.getenv('SSM_MAX_RPS', 20))),
+    max_attempts=int(os.getenv('SSM_MAX_ATTEMPTS', 5))
+)
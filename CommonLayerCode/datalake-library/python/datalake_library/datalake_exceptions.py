@@ -11,4 +11,9 @@ class InvalidS3PutEventException(Exception):
 class UnprocessedKeysException(RuntimeError):
    """Raised when keys are unprocessed, either because the batch limit is exceeded, the size of the response is too big
   (>16Mb) or the keys were throttled because of ProvisionedReads too low on ddb"""
-   pass
\ No newline at end of file
+   pass
+
+
+class MessageSendFailedException(RuntimeError):
+   """Raised when messages could not be sent to an SQS queue, even after retries"""
+   pass
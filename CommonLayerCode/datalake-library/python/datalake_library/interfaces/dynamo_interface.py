@@ -1,11 +1,35 @@
 import os
+import copy
+import json
+import hashlib
+import queue
+import threading
+import time
 import datetime as dt
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import boto3
 from boto3.dynamodb.conditions import Key, Attr
 from botocore.exceptions import ClientError
 
-from ..commons import init_logger
+from ..commons import init_logger, TTLCache
+from ..configuration.throttling import backoff_delay
+from ..datalake_exceptions import UnprocessedKeysException
+
+MAX_BATCH_WRITE_ITEMS = 25
+MAX_BATCH_GET_ITEMS = 100
+SCAN_SEGMENT_COMPLETE = 'COMPLETE'
+
+FINGERPRINT_ATTRIBUTE = 'fingerprint'
+# skip_unchanged modes: read the stored fingerprint first, or let a conditional put reject the write
+FINGERPRINT_READ = 'read'
+FINGERPRINT_CONDITIONAL = 'conditional'
+
+# Transform mappings change rarely, keep them for the lifetime of a warm container
+transform_mapping_cache = TTLCache(default_ttl=float(os.getenv('TRANSFORM_MAPPING_CACHE_TTL', 600)))
 
 
 class DynamoInterface:
@@ -18,6 +42,12 @@ class DynamoInterface:
 
         self.object_metadata_table = None
         self.transform_mapping_table = None
+        self._index_key_names = {}
+        self._write_buffer = None
+        self._write_buffer_max_items = MAX_BATCH_WRITE_ITEMS
+        self._write_buffer_lock = threading.RLock()
+        self.catalog_writes = 0
+        self.catalog_writes_skipped = 0
 
         self._get_object_metadata_table()
         self._get_transform_mapping_table()
@@ -54,17 +84,196 @@ class DynamoInterface:
             raise
 
     def get_transform_table_item(self, dataset):
-        return self.get_item(self.transform_mapping_table, {'name': dataset})
+        item = transform_mapping_cache.get_or_load(
+            dataset, lambda name: self.get_item(self.transform_mapping_table, {'name': name}))
+        return copy.deepcopy(item)
+
+    @staticmethod
+    def invalidate_transform_table_cache(dataset=None):
+        transform_mapping_cache.invalidate(dataset)
+
+    @staticmethod
+    def transform_table_cache_stats():
+        return transform_mapping_cache.stats()
     
-    def update_object_metadata_catalog(self, item):
+    @staticmethod
+    def build_fingerprint(item):
+        """Hash of the metadata attributes of an item, ignoring id, timestamp and the fingerprint itself"""
+        attributes = {k: v for k, v in item.items() if k not in ('id', 'timestamp', FINGERPRINT_ATTRIBUTE)}
+        return hashlib.sha256(json.dumps(attributes, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def update_object_metadata_catalog(self, item, skip_unchanged=None):
+        """Upserts an object metadata item
+
+        :param item: object metadata dict, must hold bucket and key
+        :param skip_unchanged: None to always write, FINGERPRINT_READ or FINGERPRINT_CONDITIONAL to skip
+            the write when the stored fingerprint matches the item's metadata
+        :return True if the item was written, False if it was skipped
+        """
         item['id'] = self.build_id(item['bucket'], item['key'])
         item['timestamp'] = int(round(dt.datetime.utcnow().timestamp()*1000, 0))
-        return self.put_item_in_object_metadata_table(item)
+        if not skip_unchanged:
+            self.put_item_in_object_metadata_table(item)
+            self.catalog_writes += 1
+            return True
+        item[FINGERPRINT_ATTRIBUTE] = self.build_fingerprint(item)
+        # Buffered writes are batched and cannot be conditional
+        if skip_unchanged == FINGERPRINT_READ or self._write_buffer is not None:
+            if self._get_current_fingerprints([item['id']]).get(item['id']) == item[FINGERPRINT_ATTRIBUTE]:
+                self.catalog_writes_skipped += 1
+                return False
+            self.put_item_in_object_metadata_table(item)
+            self.catalog_writes += 1
+            return True
+        try:
+            self.object_metadata_table.put_item(
+                Item=item,
+                ConditionExpression=Attr(FINGERPRINT_ATTRIBUTE).not_exists() |
+                Attr(FINGERPRINT_ATTRIBUTE).ne(item[FINGERPRINT_ATTRIBUTE])
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                self.catalog_writes_skipped += 1
+                return False
+            msg = 'Error putting item {} into {} table'.format(item, self.object_metadata_table)
+            self._logger.exception(msg)
+            raise
+        self.catalog_writes += 1
+        return True
+
+    def catalog_write_stats(self):
+        return {
+            'writes': self.catalog_writes,
+            'skipped': self.catalog_writes_skipped
+        }
+
+    def _get_current_fingerprints(self, ids):
+        """Fingerprints the items will have once buffered writes are flushed
+
+        A pending put with no update queued after it is compared against directly. Any other
+        buffered change leaves the fingerprint unknown so the write goes through. Only ids with
+        nothing buffered are read from the table.
+        """
+        fingerprints = {}
+        unbuffered = []
+        with self._write_buffer_lock:
+            for item_id in ids:
+                pending = self._write_buffer.get(item_id) if self._write_buffer is not None else None
+                if pending is None:
+                    unbuffered.append(item_id)
+                else:
+                    item, updates = pending
+                    fingerprints[item_id] = item.get(FINGERPRINT_ATTRIBUTE) if item is not None and not updates else None
+        if unbuffered:
+            fingerprints.update(self._get_stored_fingerprints(unbuffered))
+        return fingerprints
+
+    def _get_stored_fingerprints(self, ids, max_attempts=8):
+        table_name = self.object_metadata_table.name
+        fingerprints = {}
+        for x in range(0, len(ids), MAX_BATCH_GET_ITEMS):
+            request_items = {
+                table_name: {
+                    'Keys': [{'id': item_id} for item_id in ids[x:x + MAX_BATCH_GET_ITEMS]],
+                    'ProjectionExpression': '#id, #fp',
+                    'ExpressionAttributeNames': {'#id': 'id', '#fp': FINGERPRINT_ATTRIBUTE}
+                }
+            }
+            for attempt in range(max_attempts):
+                try:
+                    response = self.dynamodb_resource.meta.client.batch_get_item(RequestItems=request_items)
+                except ClientError:
+                    msg = 'Error getting fingerprints from {} table'.format(table_name)
+                    self._logger.exception(msg)
+                    raise
+                for stored in response['Responses'].get(table_name, []):
+                    fingerprints[stored['id']] = stored.get(FINGERPRINT_ATTRIBUTE)
+                request_items = response.get('UnprocessedKeys')
+                if not request_items:
+                    break
+                time.sleep(backoff_delay(attempt, base=0.05))
+            else:
+                msg = '{} keys unprocessed after {} attempts'.format(len(request_items[table_name]['Keys']),
+                                                                     max_attempts)
+                self._logger.error(msg)
+                raise UnprocessedKeysException(msg)
+        return fingerprints
+
+    def batch_update_object_metadata_catalog(self, items, max_workers=1, max_attempts=8, skip_unchanged=None):
+        """Writes object metadata items with BatchWriteItem, 25 items per request
+
+        :param items: object metadata dicts, enriched with id and timestamp as in update_object_metadata_catalog
+        :param max_workers: number of chunks submitted in parallel
+        :param max_attempts: attempts per chunk before UnprocessedItems are reported as an error
+        :param skip_unchanged: when set, items whose stored fingerprint matches are not written;
+            fingerprints are read with BatchGetItem since batch writes cannot be conditional, or taken
+            from the write-behind buffer when a put for the id is pending
+        :return the enriched items
+        """
+        items = list(items)
+        timestamp = int(round(dt.datetime.utcnow().timestamp()*1000, 0))
+        unique_items = {}
+        for item in items:
+            item['id'] = self.build_id(item['bucket'], item['key'])
+            item['timestamp'] = timestamp
+            if skip_unchanged:
+                item[FINGERPRINT_ATTRIBUTE] = self.build_fingerprint(item)
+            # BatchWriteItem rejects a request holding the same key twice
+            unique_items[item['id']] = item
+        if skip_unchanged and unique_items:
+            stored = self._get_current_fingerprints(list(unique_items))
+            unchanged = [i for i, item in unique_items.items() if stored.get(i) == item[FINGERPRINT_ATTRIBUTE]]
+            for item_id in unchanged:
+                del unique_items[item_id]
+            self.catalog_writes_skipped += len(unchanged)
+        self.catalog_writes += len(unique_items)
+        if self._write_buffer is not None:
+            for item in unique_items.values():
+                self._buffer_put(item)
+            return items
+        requests = [{'PutRequest': {'Item': item}} for item in unique_items.values()]
+        chunks = [requests[x:x + MAX_BATCH_WRITE_ITEMS] for x in range(0, len(requests), MAX_BATCH_WRITE_ITEMS)]
+        self._logger.info('Writing {} items to {} in {} batches'.format(len(requests),
+                                                                       self.object_metadata_table.name,
+                                                                       len(chunks)))
+        if max_workers > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+                list(executor.map(lambda chunk: self._batch_write_chunk(self.object_metadata_table, chunk,
+                                                                        max_attempts), chunks))
+        else:
+            for chunk in chunks:
+                self._batch_write_chunk(self.object_metadata_table, chunk, max_attempts)
+        return items
+
+    def _batch_write_chunk(self, table, requests, max_attempts):
+        request_items = {table.name: requests}
+        for attempt in range(max_attempts):
+            try:
+                response = self.dynamodb_resource.meta.client.batch_write_item(RequestItems=request_items)
+            except ClientError:
+                msg = 'Error batch writing items into {} table'.format(table.name)
+                self._logger.exception(msg)
+                raise
+            request_items = response.get('UnprocessedItems')
+            if not request_items:
+                return
+            self._logger.info('Retrying {} unprocessed items'.format(len(request_items[table.name])))
+            time.sleep(backoff_delay(attempt, base=0.05))
+        msg = '{} items unprocessed after {} attempts'.format(len(request_items[table.name]), max_attempts)
+        self._logger.error(msg)
+        raise UnprocessedKeysException(msg)
 
     def put_item_in_object_metadata_table(self, item):
+        if self._write_buffer is not None:
+            return self._buffer_put(item)
         return self.put_item(self.object_metadata_table, item)
 
     def update_object(self, bucket, key, attribute_updates):
+        # The stored fingerprint no longer describes the item once it is partially updated
+        attribute_updates = dict(attribute_updates)
+        attribute_updates.setdefault(FINGERPRINT_ATTRIBUTE, {'Action': 'DELETE'})
+        if self._write_buffer is not None:
+            return self._buffer_update(self.build_id(bucket, key), attribute_updates)
         try:
             self.object_metadata_table.update_item(
                 Key={'id': self.build_id(bucket, key)},
@@ -76,40 +285,302 @@ class DynamoInterface:
             raise
     
     def remove_object_attribute(self, bucket, key, attribute):
+        # The stored fingerprint no longer describes the item once an attribute is removed
+        attributes = list(dict.fromkeys([attribute, FINGERPRINT_ATTRIBUTE]))
+        if self._write_buffer is not None:
+            return self._buffer_update(self.build_id(bucket, key), {a: {'Action': 'DELETE'} for a in attributes})
         try:    
             self.object_metadata_table.update_item(  
                 Key={'id': self.build_id(bucket, key)},
-                UpdateExpression='REMOVE {}'.format(attribute)
+                UpdateExpression='REMOVE {}'.format(', '.join(attributes))
             )          
         except ClientError:
             msg = 'Error removing attribute {} for object s3://{}/{}'.format(attribute, bucket, key)
             self._logger.exception(msg)
             raise
     
+    @contextmanager
+    def write_behind(self, max_items=MAX_BATCH_WRITE_ITEMS):
+        """Buffers object catalog writes and flushes them in batches
+
+        put_item_in_object_metadata_table, update_object_metadata_catalog, update_object and
+        remove_object_attribute calls for the same id are coalesced where the result is unchanged,
+        see _buffer_update.
+        The buffer is flushed whenever it holds max_items ids and when the block exits.
+
+        :param max_items: number of buffered ids that triggers a flush
+        """
+        if self._write_buffer is not None:
+            # Nested use joins the outer buffer
+            yield self
+            return
+        self._write_buffer = OrderedDict()
+        self._write_buffer_max_items = max_items
+        try:
+            yield self
+        finally:
+            try:
+                self.flush()
+            finally:
+                self._write_buffer = None
+
+    def buffered(self, func):
+        """Decorator running func, typically a lambda_handler, inside write_behind()"""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.write_behind():
+                return func(*args, **kwargs)
+        return wrapper
+
+    @staticmethod
+    def _is_overwrite(update):
+        """True for updates whose result does not depend on the previous value: PUT and whole-attribute DELETE"""
+        action = update.get('Action', 'PUT')
+        return action == 'PUT' or (action == 'DELETE' and 'Value' not in update)
+
+    def _buffer_put(self, item):
+        with self._write_buffer_lock:
+            # A full-item write supersedes anything buffered for the id
+            self._write_buffer[item['id']] = (item, [])
+            self._write_buffer.move_to_end(item['id'])
+        self._flush_if_full()
+
+    def _buffer_update(self, item_id, attribute_updates):
+        """Buffers an update, applied after the pending writes of the same id
+
+        Overwrites (PUT, DELETE without Value) are folded into a pending put or merged into the
+        previous update. ADD and set DELETE depend on the stored value, so they are only merged
+        when the previous update does not touch the same attribute and are kept in order otherwise.
+        """
+        with self._write_buffer_lock:
+            item, updates = self._write_buffer.get(item_id, (None, []))
+            for attribute, update in attribute_updates.items():
+                if item is not None and not updates and self._is_overwrite(update):
+                    if update.get('Action', 'PUT') == 'DELETE':
+                        item.pop(attribute, None)
+                    else:
+                        item[attribute] = update['Value']
+                elif updates and (self._is_overwrite(update) or attribute not in updates[-1]):
+                    updates[-1][attribute] = update
+                else:
+                    updates.append({attribute: update})
+            self._write_buffer[item_id] = (item, updates)
+        self._flush_if_full()
+
+    def _flush_if_full(self):
+        if len(self._write_buffer) >= self._write_buffer_max_items:
+            self.flush()
+
+    def flush(self):
+        """Writes every buffered object catalog change, puts with BatchWriteItem then updates in order"""
+        with self._write_buffer_lock:
+            if not self._write_buffer:
+                return
+            pending = list(self._write_buffer.items())
+            self._write_buffer.clear()
+            puts = [{'PutRequest': {'Item': item}} for _, (item, _) in pending if item is not None]
+            updates = [(item_id, update) for item_id, (_, id_updates) in pending for update in id_updates]
+            self._logger.info('Flushing {} puts and {} updates to {}'.format(len(puts), len(updates),
+                                                                            self.object_metadata_table.name))
+            for x in range(0, len(puts), MAX_BATCH_WRITE_ITEMS):
+                self._batch_write_chunk(self.object_metadata_table, puts[x:x + MAX_BATCH_WRITE_ITEMS], 8)
+            for item_id, attribute_updates in updates:
+                try:
+                    self.object_metadata_table.update_item(
+                        Key={'id': item_id},
+                        AttributeUpdates=attribute_updates
+                    )
+                except ClientError:
+                    msg = 'Error updating object {}'.format(item_id)
+                    self._logger.exception(msg)
+                    raise
+
     def query_object_metadata_index(self, index, key_expression, key_value, filter_expression, filter_value, max_items):
+        return list(self.iter_object_metadata_index(index, key_expression, key_value,
+                                                    filter_expression=filter_expression,
+                                                    filter_value=filter_value,
+                                                    max_items=max_items))
+
+    def iter_object_metadata_index(self, index, key_expression, key_value, **kwargs):
+        """Yields items of an object metadata index one at a time, see query_object_metadata_pages"""
+        for items, _ in self.query_object_metadata_pages(index, key_expression, key_value, **kwargs):
+            for item in items:
+                yield item
+
+    def query_object_metadata_pages(self, index, key_expression, key_value, sort_key_condition=None,
+                                    filter_expression=None, filter_value=None, projection=None,
+                                    max_items=None, page_size=None, exclusive_start_key=None):
+        """Queries an object metadata index lazily, one DynamoDB page at a time
+
+        :param index: name of the index to query
+        :param key_expression: partition key attribute of the index
+        :param key_value: partition key value
+        :param sort_key_condition: optional sort key range, e.g. Key('timestamp').between(start, end)
+        :param filter_expression: optional attribute to filter on (filtered items are still read)
+        :param filter_value: value filter_expression must equal
+        :param projection: optional list of attributes to return, key attributes are always included
+        :param max_items: stop once this many items have been yielded
+        :param page_size: maximum items read per request
+        :param exclusive_start_key: cursor returned by a previous call to resume from
+        :return generator of (items, cursor) tuples, cursor is None once the index is exhausted
+        """
+        key_condition = Key(key_expression).eq(key_value)
+        if sort_key_condition is not None:
+            key_condition = key_condition & sort_key_condition
+        query_kwargs = {
+            'IndexName': index,
+            'KeyConditionExpression': key_condition
+        }
+        if filter_expression:
+            query_kwargs['FilterExpression'] = Attr(filter_expression).eq(filter_value)
+        if projection:
+            attributes = list(projection)
+            attributes += [k for k in self._get_index_key_names(index) if k not in attributes]
+            query_kwargs.update(self._build_projection(attributes))
+
+        remaining = max_items
+        cursor = exclusive_start_key
+        while remaining is None or remaining > 0:
+            if cursor:
+                query_kwargs['ExclusiveStartKey'] = cursor
+            limit = page_size
+            # Without a filter every item read is returned, so never read more than needed
+            if remaining is not None and not filter_expression:
+                limit = min(limit or remaining, remaining)
+            if limit:
+                query_kwargs['Limit'] = limit
+            try:
+                response = self.object_metadata_table.query(**query_kwargs)
+            except ClientError:
+                msg = 'Error querying object metadata {} index'.format(index)
+                self._logger.exception(msg)
+                raise
+            items = response['Items']
+            cursor = response.get('LastEvaluatedKey')
+            if remaining is not None:
+                if len(items) > remaining:
+                    items = items[:remaining]
+                    # Resume right after the last item returned rather than after the page
+                    cursor = {k: items[-1][k] for k in self._get_index_key_names(index)}
+                remaining -= len(items)
+            yield items, cursor
+            if not cursor:
+                return
+
+    def _get_index_key_names(self, index):
+        if index not in self._index_key_names:
+            table = self.object_metadata_table
+            key_schemas = [table.key_schema]
+            for table_index in (table.global_secondary_indexes or []) + (table.local_secondary_indexes or []):
+                if table_index['IndexName'] == index:
+                    key_schemas.append(table_index['KeySchema'])
+            self._index_key_names[index] = list(dict.fromkeys(
+                key['AttributeName'] for key_schema in key_schemas for key in key_schema))
+        return self._index_key_names[index]
+
+    @staticmethod
+    def _build_projection(attributes):
+        # Placeholders avoid clashes with reserved words such as key, bucket or timestamp
+        return {
+            'ProjectionExpression': ', '.join('#proj{}'.format(i) for i in range(len(attributes))),
+            'ExpressionAttributeNames': {'#proj{}'.format(i): a for i, a in enumerate(attributes)}
+        }
+
+    def parallel_scan(self, segments=4, workers=None, projection=None, filter_expression=None, filter_value=None,
+                      page_size=None, checkpoints=None, on_checkpoint=None, queue_size=1000):
+        """Scans the whole object metadata table with parallel Segment/TotalSegments scans
+
+        Items are streamed through a bounded queue so memory stays flat regardless of table size.
+        A segment checkpoint only advances once every item of its page has been yielded, so an
+        interrupted scan resumed with the same checkpoints dict repeats at most one page per segment.
+
+        :param segments: TotalSegments to split the table into
+        :param workers: threads scanning segments concurrently, segments if None
+        :param projection: optional list of attributes to return
+        :param filter_expression: optional attribute to filter on
+        :param filter_value: value filter_expression must equal
+        :param page_size: maximum items read per scan request
+        :param checkpoints: dict of segment to LastEvaluatedKey (or SCAN_SEGMENT_COMPLETE), updated in place
+        :param on_checkpoint: optional callback(segment, cursor) called whenever a checkpoint advances
+        :param queue_size: maximum items buffered between the scanning threads and the caller
+        :return generator of items
+        """
+        workers = workers or segments
+        checkpoints = checkpoints if checkpoints is not None else {}
+        results = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
+        finished = object()
+        errors = []
+
+        scan_kwargs = {'TableName': self.object_metadata_table.name, 'TotalSegments': segments}
+        if projection:
+            scan_kwargs.update(self._build_projection(list(projection)))
+        if filter_expression:
+            scan_kwargs['FilterExpression'] = Attr(filter_expression).eq(filter_value)
+        if page_size:
+            scan_kwargs['Limit'] = page_size
+
+        def put(entry):
+            while not stop.is_set():
+                try:
+                    results.put(entry, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def scan_segment(segment):
+            cursor = checkpoints.get(segment)
+            if cursor == SCAN_SEGMENT_COMPLETE:
+                return
+            kwargs = dict(scan_kwargs, Segment=segment)
+            while not stop.is_set():
+                if cursor:
+                    kwargs['ExclusiveStartKey'] = cursor
+                response = self.dynamodb_resource.meta.client.scan(**kwargs)
+                for item in response['Items']:
+                    if not put(item):
+                        return
+                cursor = response.get('LastEvaluatedKey')
+                if not put((finished, segment, cursor or SCAN_SEGMENT_COMPLETE)) or not cursor:
+                    return
+
+        def run_segment(segment):
+            try:
+                scan_segment(segment)
+            except Exception as e:
+                self._logger.exception('Error scanning segment {} of {}'.format(segment, self.object_metadata_table.name))
+                errors.append(e)
+                stop.set()
+
+        def run_all():
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(run_segment, range(segments)))
+            put(finished)
+
+        self._logger.info('Scanning {} with {} segments on {} workers'.format(self.object_metadata_table.name,
+                                                                             segments, workers))
+        coordinator = threading.Thread(target=run_all, daemon=True)
+        coordinator.start()
         try:
-            items = []
-            response = self.object_metadata_table.query(
-                IndexName=index,
-                KeyConditionExpression=Key(key_expression).eq(key_value),
-                FilterExpression=Attr(filter_expression).eq(filter_value)
-            )
-            if response['Items']:
-                items.extend(response['Items'])
-            while 'LastEvaluatedKey' in response: 
-                response = self.object_metadata_table.query(
-                    IndexName=index,
-                    KeyConditionExpression=Key(key_expression).eq(key_value),
-                    FilterExpression=Attr(filter_expression).eq(filter_value),
-                    ExclusiveStartKey=response['LastEvaluatedKey']           
-                )
-                if response['Items']: 
-                    items.extend(response['Items'])
-                if len(items) > max_items:
-                    items = items[:max_items]
+            while True:
+                try:
+                    entry = results.get(timeout=0.5)
+                except queue.Empty:
+                    if errors and not coordinator.is_alive():
+                        break
+                    continue
+                if entry is finished:
                     break
-        except ClientError:
-            msg = 'Error querying object metadata {} index'.format(index)
-            self._logger.exception(msg)
-            raise
-        return items
+                if isinstance(entry, tuple) and entry and entry[0] is finished:
+                    _, segment, cursor = entry
+                    checkpoints[segment] = cursor
+                    if on_checkpoint:
+                        on_checkpoint(segment, cursor)
+                    continue
+                yield entry
+        finally:
+            stop.set()
+            coordinator.join()
+        if errors:
+            raise errors[0]
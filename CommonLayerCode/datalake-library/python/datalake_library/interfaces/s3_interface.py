@@ -1,36 +1,205 @@
+import io
 import os
 import json
-from io import StringIO
+import zlib
+import gzip
+import codecs
+import time
+import shutil
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from io import BytesIO, StringIO
 from urllib.parse import unquote_plus
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
-from ..commons import init_logger
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from ..commons import init_logger, TTLCache
+from ..configuration.throttling import backoff_delay
 from ..datalake_exceptions import ObjectDeleteFailedException
 
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_MEMORY_THRESHOLD = 8 * 1024 * 1024
+
+DOWNLOAD_MODE_FILE = 'file'
+DOWNLOAD_MODE_BYTES = 'bytes'
+DOWNLOAD_MODE_MEMORYVIEW = 'memoryview'
+DOWNLOAD_MODE_AUTO = 'auto'
+
+COMPRESSION_GZIP = 'gzip'
+COMPRESSION_ZSTD = 'zstd'
+COMPRESSION_SUFFIXES = {'.gz': COMPRESSION_GZIP, '.gzip': COMPRESSION_GZIP, '.zst': COMPRESSION_ZSTD}
+# S3 multipart parts must be at least 5 MB, except the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+MB = 1024 * 1024
+# Sized so bulk operations and multipart transfers do not queue on the client's connection pool
+MAX_POOL_CONNECTIONS = 50
+DEFAULT_BULK_WORKERS = 10
+# Multipart settings sized to the network and CPU share Lambda allocates with memory
+TRANSFER_PROFILES = {
+    'default': {'multipart_threshold': 8 * MB, 'multipart_chunksize': 8 * MB, 'max_concurrency': 10,
+                'use_threads': True},
+    'lambda-small': {'multipart_threshold': 8 * MB, 'multipart_chunksize': 8 * MB, 'max_concurrency': 4,
+                     'use_threads': True},
+    'lambda-medium': {'multipart_threshold': 16 * MB, 'multipart_chunksize': 16 * MB, 'max_concurrency': 10,
+                      'use_threads': True},
+    'lambda-large': {'multipart_threshold': 32 * MB, 'multipart_chunksize': 32 * MB, 'max_concurrency': 20,
+                     'use_threads': True},
+    'single-threaded': {'multipart_threshold': 8 * MB, 'multipart_chunksize': 8 * MB, 'max_concurrency': 1,
+                        'use_threads': False}
+}
+
+
+def transfer_profile_for_memory(memory_mb):
+    """Name of the transfer profile suited to a Lambda memory size in MB"""
+    if memory_mb <= 512:
+        return 'lambda-small'
+    if memory_mb <= 1769:
+        return 'lambda-medium'
+    return 'lambda-large'
+
+
+def build_transfer_config(profile=None):
+    """Builds a TransferConfig from a profile name, a dict of TransferConfig arguments or a TransferConfig
+
+    With no profile, the preset matching AWS_LAMBDA_FUNCTION_MEMORY_SIZE is used, or 'default' outside Lambda.
+    """
+    if isinstance(profile, TransferConfig):
+        return profile
+    if profile is None:
+        memory_mb = os.getenv('AWS_LAMBDA_FUNCTION_MEMORY_SIZE')
+        profile = transfer_profile_for_memory(int(memory_mb)) if memory_mb else 'default'
+    if isinstance(profile, str):
+        profile = TRANSFER_PROFILES[profile]
+    return TransferConfig(**profile)
+
 
 class S3Interface:
-    def __init__(self, log_level=None, s3_client=None, s3_resource=None):
+    def __init__(self, log_level=None, s3_client=None, s3_resource=None, transfer_profile=None):
+        """
+        Interface to S3 objects
+        :param log_level: level the class logger should log at
+        :param s3_client: s3 client, normally boto
+        :param s3_resource: s3 resource, normally boto
+        :param transfer_profile: default multipart settings for upload, download and copy, see build_transfer_config
+        """
         self.log_level = log_level or os.getenv('LOG_LEVEL', 'INFO')
         self._logger = init_logger(__name__, self.log_level)
-        self._s3_client = s3_client or boto3.client('s3')
-        self._s3_resource = s3_resource or boto3.resource('s3')
+        self._s3_client = s3_client or boto3.client('s3', config=Config(max_pool_connections=MAX_POOL_CONNECTIONS))
+        self._s3_resource = s3_resource or boto3.resource('s3', config=Config(max_pool_connections=MAX_POOL_CONNECTIONS))
+        self._work_dir = None
+        self._work_dir_depth = 0
+        self._transfer_config = build_transfer_config(transfer_profile)
+        self.transfer_stats = deque(maxlen=100)
+        self._head_cache = TTLCache(default_ttl=float(os.getenv('S3_HEAD_CACHE_TTL', 60)),
+                                          max_entries=int(os.getenv('S3_HEAD_CACHE_SIZE', 1024)))
+
+    def set_transfer_profile(self, transfer_profile):
+        self._transfer_config = build_transfer_config(transfer_profile)
+
+    def _get_transfer_config(self, transfer_profile=None):
+        return self._transfer_config if transfer_profile is None else build_transfer_config(transfer_profile)
 
-    def download_object(self, bucket, key):
+    def _record_transfer(self, operation, bucket, key, size, started):
+        elapsed = time.monotonic() - started
+        stats = {
+            'operation': operation,
+            'bucket': bucket,
+            'key': key,
+            'bytes': size,
+            'seconds': elapsed,
+            'mb_per_second': size / MB / elapsed if elapsed > 0 else None
+        }
+        self.transfer_stats.append(stats)
+        self._logger.info('{} of {}/{}: {} bytes in {:.3f}s'.format(operation, bucket, key, size, elapsed))
+        return stats
+
+    def download_object(self, bucket, key, mode=DOWNLOAD_MODE_FILE, memory_threshold=DEFAULT_MEMORY_THRESHOLD,
+                        transfer_profile=None):
+        """Downloads an object to the work directory or to memory
+
+        :param mode: DOWNLOAD_MODE_FILE returns a local path under the work directory that mirrors the key,
+            DOWNLOAD_MODE_BYTES a BytesIO, DOWNLOAD_MODE_MEMORYVIEW a memoryview, and DOWNLOAD_MODE_AUTO
+            a BytesIO for objects up to memory_threshold bytes and a local path otherwise
+        :param memory_threshold: largest ContentLength kept in memory in DOWNLOAD_MODE_AUTO
+        :param transfer_profile: multipart settings for this call, the interface default if None
+        """
         self._logger.info('Downloading object: {}/{}'.format(bucket, key))
-        object_path = '/tmp/' + key.split('/')[-1]
         key = unquote_plus(key)
+        config = self._get_transfer_config(transfer_profile)
+        if mode == DOWNLOAD_MODE_AUTO:
+            mode = DOWNLOAD_MODE_BYTES if self.get_size(bucket, key) <= memory_threshold else DOWNLOAD_MODE_FILE
+        started = time.monotonic()
         try:
-            self._s3_resource.Bucket(bucket).download_file(key, object_path)
+            if mode == DOWNLOAD_MODE_FILE:
+                object_path = self._get_local_path(key)
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                self._s3_resource.Bucket(bucket).download_file(key, object_path, Config=config)
+                self._record_transfer('download', bucket, key, os.path.getsize(object_path), started)
+                return object_path
+            data = BytesIO()
+            self._s3_client.download_fileobj(bucket, key, data, Config=config)
         except ClientError:
             msg = 'Error downloading object: {}/{}'.format(bucket, key)
             self._logger.exception(msg)
             raise
+        self._record_transfer('download', bucket, key, data.tell(), started)
+        if mode == DOWNLOAD_MODE_MEMORYVIEW:
+            return data.getbuffer()
+        data.seek(0)
+        return data
+
+    def _get_local_path(self, key):
+        """Path under the work directory mirroring key, keys escaping it with '..' are rejected"""
+        work_dir = os.path.realpath(self.get_work_dir())
+        object_path = os.path.realpath(os.path.join(work_dir, key.lstrip('/')))
+        if os.path.commonpath([work_dir, object_path]) != work_dir or object_path == work_dir:
+            msg = 'Object key resolves outside the work directory: {}'.format(key)
+            self._logger.error(msg)
+            raise ValueError(msg)
         return object_path
 
-    def upload_object(self, object_path, bucket, key, kms_key=None):
+    def get_work_dir(self):
+        """Unique directory under /tmp holding the files downloaded by this interface"""
+        if not self._work_dir or not os.path.isdir(self._work_dir):
+            self._work_dir = tempfile.mkdtemp(prefix='s3-', dir='/tmp')
+        return self._work_dir
+
+    def cleanup_work_dir(self):
+        if self._work_dir:
+            shutil.rmtree(self._work_dir, ignore_errors=True)
+            self._work_dir = None
+
+    @contextmanager
+    def work_directory(self):
+        """Scopes downloads to a fresh work directory removed on exit, e.g. one per invocation
+
+        Nested use shares the outer directory, which is only removed when the outermost block exits.
+        """
+        if self._work_dir_depth == 0:
+            self.cleanup_work_dir()
+        self._work_dir_depth += 1
+        try:
+            yield self.get_work_dir()
+        finally:
+            self._work_dir_depth -= 1
+            if self._work_dir_depth == 0:
+                self.cleanup_work_dir()
+
+    def upload_object(self, object_path, bucket, key, kms_key=None, transfer_profile=None):
         self._logger.info('Uploading object: {}'.format(object_path))
+        started = time.monotonic()
         try:
             extra_kwargs = {}
             if kms_key:
@@ -40,22 +209,76 @@ class S3Interface:
                 }
             self._s3_client.upload_file(object_path,
                                         bucket, key,
-                                        ExtraArgs=extra_kwargs)
+                                        ExtraArgs=extra_kwargs,
+                                        Config=self._get_transfer_config(transfer_profile))
         except ClientError:
             msg = 'Error uploading object: {}/{}'.format(bucket, key)
             self._logger.exception(msg)
             raise
+        self.invalidate_head_cache(bucket, key)
+        self._record_transfer('upload', bucket, key, os.path.getsize(object_path), started)
         return
 
-    def list_objects(self, bucket, keys_path):
+    def list_objects(self, bucket, keys_path, parallel=False):
+        """Lists the keys under keys_path, fanning out across its sub-prefixes when parallel is set"""
         keys_path = unquote_plus(keys_path)
         self._logger.info('Listing objects in: s3://{}/{}'.format(bucket, keys_path))
         keys_path = keys_path + '/' if not keys_path.endswith('/') else keys_path
-        keys = []
-        for obj in self._s3_resource.Bucket(bucket).objects.filter(Prefix=keys_path):
-            if obj.key[-1] != '/':
-                keys.append(obj.key)
-        return keys
+        objects = self.iter_objects_parallel(bucket, keys_path) if parallel else self.iter_objects(bucket, keys_path)
+        return [obj['Key'] for obj in objects if obj['Key'][-1] != '/']
+
+    def iter_objects(self, bucket, prefix, start_after=None, delimiter=None, page_size=None):
+        """Lazily lists objects under prefix, one ListObjectsV2 page at a time
+
+        :param start_after: key to start listing after
+        :param delimiter: when set, keys rolled up into common prefixes are yielded as {'Prefix': ...} entries
+        :param page_size: maximum keys per request
+        :return generator of {'Key', 'Size', 'ETag', 'LastModified'} dicts
+        """
+        kwargs = {'Bucket': bucket, 'Prefix': prefix}
+        if start_after:
+            kwargs['StartAfter'] = start_after
+        if delimiter:
+            kwargs['Delimiter'] = delimiter
+        if page_size:
+            kwargs['PaginationConfig'] = {'PageSize': page_size}
+        try:
+            for page in self._s3_client.get_paginator('list_objects_v2').paginate(**kwargs):
+                for common_prefix in page.get('CommonPrefixes', []):
+                    yield {'Prefix': common_prefix['Prefix']}
+                for obj in page.get('Contents', []):
+                    yield {
+                        'Key': obj['Key'],
+                        'Size': obj['Size'],
+                        'ETag': obj['ETag'],
+                        'LastModified': obj['LastModified']
+                    }
+        except ClientError:
+            msg = 'Error listing objects in: s3://{}/{}'.format(bucket, prefix)
+            self._logger.exception(msg)
+            raise
+
+    def iter_objects_parallel(self, bucket, prefix, delimiter='/', max_workers=DEFAULT_BULK_WORKERS):
+        """Lists objects under prefix by fanning out across its common prefixes (e.g. partitions) in parallel
+
+        Objects directly under prefix are yielded first, then each partition's objects as its listing completes.
+        :return generator of {'Key', 'Size', 'ETag', 'LastModified'} dicts, unordered across partitions
+        """
+        partitions = []
+        for entry in self.iter_objects(bucket, prefix, delimiter=delimiter):
+            if 'Prefix' in entry:
+                partitions.append(entry['Prefix'])
+            else:
+                yield entry
+        if not partitions:
+            return
+        self._logger.info('Listing {} partitions of s3://{}/{} in parallel'.format(len(partitions), bucket, prefix))
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(partitions))) as executor:
+            futures = [executor.submit(lambda p: list(self.iter_objects(bucket, p)), partition)
+                       for partition in partitions]
+            for future in as_completed(futures):
+                for obj in future.result():
+                    yield obj
 
     def read_object(self, bucket, key):
         key = unquote_plus(key)
@@ -72,6 +295,111 @@ class S3Interface:
             raise
         return data
 
+    def open_object(self, bucket, key):
+        """Returns a binary file-like stream over the object body, read lazily from S3"""
+        key = unquote_plus(key)
+        self._logger.info("Opening object stream {}/{}".format(bucket, key))
+        try:
+            return self._s3_client.get_object(Bucket=bucket, Key=key)['Body']
+        except ClientError:
+            msg = 'Error reading object: {}/{}'.format(bucket, key)
+            self._logger.exception(msg)
+            raise
+
+    def iter_object_chunks(self, bucket, key, chunk_size=DEFAULT_CHUNK_SIZE, encoding=None):
+        """Yields the object body in chunks of at most chunk_size bytes
+
+        :param encoding: when set, chunks are decoded incrementally and yielded as str
+        """
+        body = self.open_object(bucket, key)
+        decoder = codecs.getincrementaldecoder(encoding)() if encoding else None
+        try:
+            while True:
+                chunk = body.read(chunk_size)
+                if not chunk:
+                    break
+                yield decoder.decode(chunk) if decoder else chunk
+            if decoder:
+                tail = decoder.decode(b'', final=True)
+                if tail:
+                    yield tail
+        finally:
+            body.close()
+
+    def iter_object_lines(self, bucket, key, encoding='utf-8', chunk_size=DEFAULT_CHUNK_SIZE, keepends=False):
+        """Yields the object body line by line in constant memory
+
+        :param encoding: lines are decoded with it, raw bytes are yielded if None
+        :param keepends: keep the trailing newline of each line
+        """
+        pending = b''
+        for chunk in self.iter_object_chunks(bucket, key, chunk_size):
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                line = line + b'\n' if keepends else line
+                yield line.decode(encoding) if encoding else line
+        if pending:
+            yield pending.decode(encoding) if encoding else pending
+
+    def _get_range(self, bucket, key, byte_range):
+        key = unquote_plus(key)
+        self._logger.info("Reading {} of object {}/{}".format(byte_range, bucket, key))
+        try:
+            return self._s3_client.get_object(Bucket=bucket, Key=key, Range=byte_range)['Body']
+        except ClientError:
+            msg = 'Error reading {} of object: {}/{}'.format(byte_range, bucket, key)
+            self._logger.exception(msg)
+            raise
+
+    def read_range(self, bucket, key, start, end=None, stream=False):
+        """Reads bytes start to end (inclusive, to the end of the object if None) of an object
+
+        :param stream: return the body stream instead of the bytes
+        """
+        byte_range = 'bytes={}-{}'.format(start, '' if end is None else end)
+        body = self._get_range(bucket, key, byte_range)
+        return body if stream else body.read()
+
+    def read_tail(self, bucket, key, n, stream=False):
+        """Reads the last n bytes of an object, e.g. a Parquet footer
+
+        :param stream: return the body stream instead of the bytes
+        """
+        body = self._get_range(bucket, key, 'bytes=-{}'.format(n))
+        return body if stream else body.read()
+
+    def select_object(self, bucket, key, expression, input_serialization, output_serialization=None):
+        """Runs an S3 Select SQL expression on a CSV, JSON or Parquet object and streams the matching records
+
+        :param expression: SQL expression, e.g. "SELECT s.id FROM S3Object s WHERE s.recclass = 'L5'"
+        :param input_serialization: S3 Select InputSerialization, e.g. {'JSON': {'Type': 'LINES'}}
+        :param output_serialization: S3 Select OutputSerialization, JSON lines if None
+        :return generator of raw record payload bytes
+        """
+        key = unquote_plus(key)
+        self._logger.info("Selecting from object {}/{}".format(bucket, key))
+        try:
+            response = self._s3_client.select_object_content(
+                Bucket=bucket,
+                Key=key,
+                ExpressionType='SQL',
+                Expression=expression,
+                InputSerialization=input_serialization,
+                OutputSerialization=output_serialization or {'JSON': {'RecordDelimiter': '\n'}}
+            )
+            for event in response['Payload']:
+                if 'Records' in event:
+                    yield event['Records']['Payload']
+                elif 'Stats' in event:
+                    details = event['Stats']['Details']
+                    self._logger.info('Select scanned {} bytes, returned {} bytes'.format(details['BytesScanned'],
+                                                                                          details['BytesReturned']))
+        except ClientError:
+            msg = 'Error selecting from object: {}/{}'.format(bucket, key)
+            self._logger.exception(msg)
+            raise
+
     def write_object(self, bucket, key, data_object, kms_key=None):
         self._logger.info("Writing object to {}/{}".format(bucket, key))
         try:
@@ -84,12 +412,115 @@ class S3Interface:
                     "SSEKMSKeyId": kms_key
                 }
             self._s3_client.put_object(Bucket=bucket, Key=key, Body=data_object.read(), **extra_kwargs)
+            self.invalidate_head_cache(bucket, key)
         except ClientError:
             msg = 'Error uploading object: {}/{}'.format(bucket, key)
             self._logger.exception(msg)
             raise
 
-    def copy_object(self, source_bucket, source_key, dest_bucket, dest_key=None, kms_key=None):
+    @staticmethod
+    def _resolve_compression(key, compression=None, content_encoding=None):
+        if content_encoding not in (COMPRESSION_GZIP, COMPRESSION_ZSTD):
+            content_encoding = None
+        compression = compression or content_encoding or COMPRESSION_SUFFIXES.get(os.path.splitext(key)[1].lower())
+        if compression == COMPRESSION_ZSTD and zstandard is None:
+            raise ValueError('zstd compression requires the zstandard package')
+        if compression not in (None, COMPRESSION_GZIP, COMPRESSION_ZSTD):
+            raise ValueError('Unsupported compression: {}'.format(compression))
+        return compression
+
+    def write_object_compressed(self, bucket, key, data_object, compression=None, kms_key=None,
+                                part_size=8 * 1024 * 1024, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Compresses data_object while streaming it to S3 through a multipart upload
+
+        The payload is read chunk_size at a time and never held in memory as a whole.
+        :param data_object: binary or text file-like object, text is encoded as utf-8
+        :param compression: COMPRESSION_GZIP or COMPRESSION_ZSTD, inferred from the key suffix (.gz, .zst) if None
+        :param part_size: compressed bytes buffered before a part is uploaded, at least 5 MB
+        """
+        compression = self._resolve_compression(key, compression) or COMPRESSION_GZIP
+        self._logger.info("Writing {} compressed object to {}/{}".format(compression, bucket, key))
+        part_size = max(part_size, MIN_PART_SIZE)
+        extra_kwargs = {'ContentEncoding': compression}
+        if kms_key:
+            extra_kwargs.update({
+                "ServerSideEncryption": "aws:kms",
+                "SSEKMSKeyId": kms_key
+            })
+        if compression == COMPRESSION_GZIP:
+            compressor = zlib.compressobj(wbits=31)
+        else:
+            compressor = zstandard.ZstdCompressor().compressobj()
+
+        upload_id = None
+        parts = []
+        buffer = BytesIO()
+
+        def upload_part(body):
+            response = self._s3_client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id,
+                                                   PartNumber=len(parts) + 1, Body=body)
+            parts.append({'PartNumber': len(parts) + 1, 'ETag': response['ETag']})
+
+        try:
+            # rewind seekable inputs for safety, streams are read from where they are
+            if getattr(data_object, 'seekable', lambda: False)():
+                data_object.seek(0)
+            while True:
+                chunk = data_object.read(chunk_size)
+                if not chunk:
+                    break
+                buffer.write(compressor.compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk))
+                if buffer.tell() >= part_size:
+                    if upload_id is None:
+                        upload_id = self._s3_client.create_multipart_upload(Bucket=bucket, Key=key,
+                                                                            **extra_kwargs)['UploadId']
+                    upload_part(buffer.getvalue())
+                    buffer = BytesIO()
+            buffer.write(compressor.flush())
+            if upload_id is None:
+                # Small payloads fit in a single request
+                self._s3_client.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue(), **extra_kwargs)
+            else:
+                upload_part(buffer.getvalue())
+                self._s3_client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                                          MultipartUpload={'Parts': parts})
+            self.invalidate_head_cache(bucket, key)
+        except Exception:
+            # Failing reads or compression must not leave an orphaned multipart upload either
+            msg = 'Error uploading object: {}/{}'.format(bucket, key)
+            self._logger.exception(msg)
+            if upload_id is not None:
+                try:
+                    self._s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+                except ClientError:
+                    self._logger.exception('Error aborting multipart upload {} of {}/{}'.format(upload_id, bucket, key))
+            raise
+
+    def read_object_compressed(self, bucket, key, compression=None, encoding='utf-8'):
+        """Returns a stream decompressing the object on the fly
+
+        :param compression: COMPRESSION_GZIP or COMPRESSION_ZSTD, inferred from ContentEncoding or the key suffix if None
+        :param encoding: text encoding of the stream, binary stream if None
+        """
+        key = unquote_plus(key)
+        self._logger.info("Reading compressed object from {}/{}".format(bucket, key))
+        try:
+            response = self._s3_client.get_object(Bucket=bucket, Key=key)
+        except ClientError:
+            msg = 'Error reading object: {}/{}'.format(bucket, key)
+            self._logger.exception(msg)
+            raise
+        compression = self._resolve_compression(key, compression, response.get('ContentEncoding'))
+        body = response['Body']
+        if compression == COMPRESSION_GZIP:
+            stream = gzip.GzipFile(fileobj=body, mode='rb')
+        elif compression == COMPRESSION_ZSTD:
+            stream = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(body))
+        else:
+            return codecs.getreader(encoding)(body) if encoding else body
+        return io.TextIOWrapper(stream, encoding=encoding) if encoding else stream
+
+    def copy_object(self, source_bucket, source_key, dest_bucket, dest_key=None, kms_key=None, transfer_profile=None):
         source_key = unquote_plus(source_key)
         self._logger.info("Copying object {}/{} to {}/{}".format(source_bucket,
                                                                  source_key,
@@ -106,10 +537,21 @@ class S3Interface:
                 'Bucket': source_bucket,
                 'Key': source_key
             }
+            copied = []
+            lock = threading.Lock()
+
+            def count_bytes(size):
+                with lock:
+                    copied.append(size)
+            started = time.monotonic()
             self._s3_resource.meta.client.copy(copy_source,
                                                dest_bucket,
                                                dest_key if dest_key else source_key,
-                                               ExtraArgs=extra_kwargs)
+                                               ExtraArgs=extra_kwargs,
+                                               Callback=count_bytes,
+                                               Config=self._get_transfer_config(transfer_profile))
+            self.invalidate_head_cache(dest_bucket, dest_key if dest_key else source_key)
+            self._record_transfer('copy', dest_bucket, dest_key if dest_key else source_key, sum(copied), started)
         except ClientError:
             msg = 'Error copying object: {}/{} to {}/{}'.format(source_bucket,
                                                                 source_key,
@@ -136,7 +578,48 @@ class S3Interface:
             self._logger.exception(msg)
             raise
 
-    def delete_objects(self, bucket, prefix):
+    def _run_bulk(self, operation, entries, max_workers):
+        """Runs operation(entry) for every entry on a bounded thread pool, collecting per-entry outcomes"""
+        def run(entry):
+            try:
+                operation(entry)
+                return {'entry': entry, 'success': True, 'error': None}
+            except ClientError as e:
+                return {'entry': entry, 'success': False, 'error': e.response['Error'].get('Code', str(e))}
+        entries = list(entries)
+        if not entries:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(entries))) as executor:
+            results = list(executor.map(run, entries))
+        failed = [r for r in results if not r['success']]
+        if failed:
+            self._logger.error('{} of {} operations failed'.format(len(failed), len(results)))
+        return results
+
+    def copy_objects(self, copies, kms_key=None, max_workers=DEFAULT_BULK_WORKERS, transfer_profile='single-threaded'):
+        """Copies many objects in parallel
+
+        :param copies: iterable of (source_bucket, source_key, dest_bucket, dest_key) tuples, dest_key may be None
+        :param transfer_profile: per-copy multipart settings, single threaded by default as copies already run in parallel
+        :return list of {'entry', 'success', 'error'} dicts, one per copy, failures do not stop the others
+        """
+        return self._run_bulk(lambda copy: self.copy_object(copy[0], copy[1], copy[2], copy[3], kms_key=kms_key,
+                                                            transfer_profile=transfer_profile),
+                              copies, max_workers)
+
+    def tag_objects(self, bucket, keys, tag_dict, max_workers=DEFAULT_BULK_WORKERS):
+        """Tags many objects of a bucket in parallel
+
+        :return list of {'entry', 'success', 'error'} dicts, one per key, failures do not stop the others
+        """
+        return self._run_bulk(lambda key: self.tag_object(bucket, key, tag_dict), keys, max_workers)
+
+    def delete_objects(self, bucket, prefix, max_workers=4, max_attempts=3):
+        """Deletes all objects under prefix, one DeleteObjects batch per listed page
+
+        Batches are submitted in parallel and keys reported in Errors are retried with backoff.
+        ObjectDeleteFailedException is raised once retries are exhausted.
+        """
         prefix = unquote_plus(prefix)
         self._logger.info('Deleting all objects in bucket {} with prefix {}'.format(bucket, prefix))
         object_paginator = self._s3_client.get_paginator('list_objects_v2')
@@ -144,21 +627,64 @@ class S3Interface:
             Bucket=bucket,
             Prefix=prefix
         )
-        for response in response_iterator:
-            if 'Contents' in response:
-                objects_to_delete = [{'Key': obj['Key']} for obj in response['Contents']]
+
+        def delete_batch(objects_to_delete):
+            for attempt in range(max_attempts):
                 delete_response = self._s3_client.delete_objects(
                     Bucket=bucket,
                     Delete={
-                        'Objects': objects_to_delete
+                        'Objects': objects_to_delete,
+                        'Quiet': True
                     }
                 )
-                if 'Errors' in delete_response:
-                    self._logger.info('Object delete failed')
-                    delete_errors = delete_response['Errors']
-                    raise ObjectDeleteFailedException(json.dumps(delete_errors))
+                delete_errors = delete_response.get('Errors')
+                if not delete_errors:
+                    return []
+                self._logger.info('Object delete failed for {} keys'.format(len(delete_errors)))
+                objects_to_delete = [{'Key': error['Key']} for error in delete_errors]
+                if attempt < max_attempts - 1:
+                    time.sleep(backoff_delay(attempt))
+            return delete_errors
+
+        delete_errors = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(delete_batch, [{'Key': obj['Key']} for obj in response['Contents']])
+                       for response in response_iterator if 'Contents' in response]
+            for future in futures:
+                delete_errors.extend(future.result())
+        self.invalidate_head_cache(bucket, prefix=prefix)
+        if delete_errors:
+            raise ObjectDeleteFailedException(json.dumps(delete_errors))
 
         self._logger.info('Successfully deleted all objects in bucket {} with prefix {}'.format(bucket, prefix))
 
+    def head_object(self, bucket, key):
+        """Returns ContentLength, ContentType, ETag, LastModified and Metadata of an object
+
+        Results are kept in a bounded LRU cache that writes, copies and deletes made through this interface invalidate.
+        """
+        def load(cache_key):
+            response = self._s3_client.head_object(Bucket=bucket, Key=key)
+            return {
+                'ContentLength': response['ContentLength'],
+                'ContentType': response.get('ContentType'),
+                'ETag': response.get('ETag'),
+                'LastModified': response.get('LastModified'),
+                'Metadata': response.get('Metadata', {})
+            }
+        return dict(self._head_cache.get_or_load('s3://{}/{}'.format(bucket, key), load))
+
+    def invalidate_head_cache(self, bucket=None, key=None, prefix=None):
+        """Drops cached HEAD results of a key, of every key under prefix in bucket, or all of them"""
+        if bucket is not None and key is not None:
+            self._head_cache.invalidate('s3://{}/{}'.format(bucket, key))
+        elif bucket is not None:
+            self._head_cache.invalidate(prefix='s3://{}/{}'.format(bucket, prefix or ''))
+        else:
+            self._head_cache.invalidate()
+
+    def head_cache_stats(self):
+        return self._head_cache.stats()
+
     def get_size(self, bucket, key):
-        return self._s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+        return self.head_object(bucket, key)['ContentLength']
@@ -1,11 +1,20 @@
 import os
+import json
 import math
+import time
 import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 from botocore.exceptions import ClientError
 
 from ..commons import init_logger
+from ..configuration.throttling import backoff_delay
+from ..datalake_exceptions import MessageSendFailedException
+
+MAX_BATCH_SIZE = 10
+MAX_BATCH_BYTES = 256 * 1024
 
 
 class SQSInterface:
@@ -14,17 +23,43 @@ class SQSInterface:
         self._logger = init_logger(__name__, self.log_level)
         self._sqs_resource = sqs_resource or boto3.resource('sqs')
 
+        self._sqs_client = self._sqs_resource.meta.client
+
         self._message_queue = self._sqs_resource.get_queue_by_name(QueueName=queue_name)
     
     def receive_messages(self, max_num_messages=1):
         return self._message_queue.receive_messages(MaxNumberOfMessages=max_num_messages, WaitTimeSeconds=1)
 
-    def receive_min_max_messages(self, min_items_process, max_items_process):
-        """Gets max_items_process messages from an SQS queue.
+    def receive_min_max_messages(self, min_items_process, max_items_process, wait_time_seconds=1, max_workers=1):
+        """Gets max_items_process messages from an SQS queue and deletes them.
         :param min_items_process: Minimum number of items to process.
         :param max_items_process: Maximum number of items to process.
+        :param wait_time_seconds: Long polling wait of each receive call.
+        :param max_workers: Number of receive calls issued concurrently.
         :return messages obtained
         """
+        # Each batch is deleted as soon as it is received: FIFO queues return nothing more
+        # from a message group while received messages of that group are still undeleted
+        messages = self._receive_batches(min_items_process, max_items_process, wait_time_seconds,
+                                         max_workers, delete=True)
+        return [message['Body'] for message in messages]
+
+    def receive_min_max_raw_messages(self, min_items_process, max_items_process, wait_time_seconds=1, max_workers=1):
+        """Gets up to max_items_process messages from an SQS queue without deleting them.
+
+        Callers delete the messages with delete_messages once they are safely handed over
+        (e.g. the downstream state machine started), otherwise they become visible again.
+        On FIFO queues this yields at most one batch per message group, as SQS holds back the
+        rest of a group until its received messages are deleted; use receive_min_max_messages there.
+        :param min_items_process: Minimum number of items to process.
+        :param max_items_process: Maximum number of items to process.
+        :param wait_time_seconds: Long polling wait of each receive call.
+        :param max_workers: Number of receive calls issued concurrently.
+        :return list of message dicts with MessageId, ReceiptHandle and Body
+        """
+        return self._receive_batches(min_items_process, max_items_process, wait_time_seconds, max_workers)
+
+    def _receive_batches(self, min_items_process, max_items_process, wait_time_seconds, max_workers, delete=False):
         messages = []
         num_messages_queue = int(self._message_queue.attributes['ApproximateNumberOfMessages'])
 
@@ -35,21 +70,54 @@ class SQSInterface:
         # Only pull batch sizes of max_batch_size
         if num_messages_queue > max_items_process:
             num_messages_queue = max_items_process
-        max_batch_size = 10
-        batch_sizes = [max_batch_size] * math.floor(num_messages_queue/max_batch_size)
-        if num_messages_queue % max_batch_size > 0:
-            batch_sizes += [num_messages_queue % max_batch_size]
-
-        for batch_size in batch_sizes:
-            resp_msg = self._message_queue.receive_messages(MaxNumberOfMessages=batch_size)
-            try:
-                messages.extend(message.body for message in resp_msg)
-                for msg in resp_msg:
-                    msg.delete()
-            except KeyError:
-                break
+        batch_sizes = [MAX_BATCH_SIZE] * math.floor(num_messages_queue/MAX_BATCH_SIZE)
+        if num_messages_queue % MAX_BATCH_SIZE > 0:
+            batch_sizes += [num_messages_queue % MAX_BATCH_SIZE]
+
+        def receive(batch_size):
+            response = self._sqs_client.receive_message(QueueUrl=self._message_queue.url,
+                                                        MaxNumberOfMessages=batch_size,
+                                                        WaitTimeSeconds=wait_time_seconds)
+            received = response.get('Messages', [])
+            if delete and received:
+                self.delete_messages(received)
+            return received
+
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(batch_sizes))) as executor:
+                for received in executor.map(receive, batch_sizes):
+                    messages.extend(received)
+        else:
+            for batch_size in batch_sizes:
+                received = receive(batch_size)
+                if not received:
+                    break
+                messages.extend(received)
         return messages
 
+    def delete_messages(self, messages, max_attempts=3):
+        """Deletes messages with DeleteMessageBatch, 10 per call, retrying failed entries.
+        :param messages: message dicts with a ReceiptHandle, or boto3 Message resources
+        :return list of entries that could not be deleted
+        """
+        receipt_handles = [m['ReceiptHandle'] if isinstance(m, dict) else m.receipt_handle for m in messages]
+        failed = []
+        for x in range(0, len(receipt_handles), MAX_BATCH_SIZE):
+            entries = [{'Id': str(i), 'ReceiptHandle': handle}
+                       for i, handle in enumerate(receipt_handles[x:x + MAX_BATCH_SIZE])]
+            for attempt in range(max_attempts):
+                response = self._sqs_client.delete_message_batch(QueueUrl=self._message_queue.url, Entries=entries)
+                failed_ids = {f['Id'] for f in response.get('Failed', [])}
+                entries = [entry for entry in entries if entry['Id'] in failed_ids]
+                if not entries:
+                    break
+                self._logger.info('Retrying deletion of {} messages'.format(len(entries)))
+                time.sleep(backoff_delay(attempt))
+            if entries:
+                self._logger.error('Failed to delete {} messages'.format(len(entries)))
+                failed.extend(entries)
+        return failed
+
     def send_message_to_fifo_queue(self, message, group_id):
         try:
             self._message_queue.send_message(MessageBody=message, MessageGroupId=group_id, MessageDeduplicationId=str(uuid.uuid1()))
@@ -63,22 +131,101 @@ class SQSInterface:
 
     def send_batch_messages_to_fifo_queue(self, messages, batch_size, group_id):
         try:
-            chunks = [messages[x:x + batch_size] for x in range(0, len(messages), batch_size)]
-            for chunk in chunks:
-                entries = []
-                for x in chunk:
-                    entry = {
-                        'Id': str(uuid.uuid1()),
-                        'MessageBody': str(x),
-                        'MessageGroupId': group_id,
-                        'MessageDeduplicationId': str(uuid.uuid1())
-                    }
-                    entries.append(entry)
-                self._message_queue.send_messages(Entries=entries)
+            outcomes = self.send_fifo_messages([(x, group_id) for x in messages], batch_size)
         except ClientError as e:
             self._logger.error("Received error: %s", e, exc_info=True)
             # If no queue is found pass else raise
             if e.response['Error']['Code'] == 'AWS.SimpleQueueService.NonExistentQueue':
-                pass
+                return
             else:
                 raise e
+        failed = [outcome for outcome in outcomes if not outcome['success']]
+        if failed:
+            raise MessageSendFailedException(json.dumps(failed))
+
+    def send_fifo_messages(self, messages, batch_size=MAX_BATCH_SIZE, max_workers=4, max_attempts=3):
+        """Sends messages with SendMessageBatch, packing batches by count and total payload size.
+
+        Message groups are sent concurrently, the batches of one group are sent in order.
+        To keep that order a group stops at its first message that cannot be sent: failed entries
+        are only retried when no later entry of their batch got through and SQS reports no sender
+        fault, and the messages after a final failure are reported with a PrecedingMessageFailed error.
+        :param messages: list of (body, group_id) tuples, non-string bodies are JSON encoded
+        :param batch_size: maximum entries per batch, at most 10
+        :param max_workers: number of message groups sent concurrently
+        :param max_attempts: attempts per batch before entries are reported as failed
+        :return list of {'body', 'group_id', 'success', 'message_id', 'error'} dicts, in input order
+        """
+        outcomes = [None] * len(messages)
+        groups = OrderedDict()
+        for index, (body, group_id) in enumerate(messages):
+            body = body if isinstance(body, str) else json.dumps(body)
+            outcomes[index] = {'body': body, 'group_id': group_id, 'success': False, 'message_id': None, 'error': None}
+            groups.setdefault(group_id, []).append(index)
+
+        def send_group(indexes):
+            for chunk in self._pack_batches(indexes, outcomes, min(batch_size, MAX_BATCH_SIZE)):
+                if not self._send_batch(chunk, outcomes, max_attempts):
+                    break
+            for index in indexes:
+                if not outcomes[index]['success'] and outcomes[index]['error'] is None:
+                    outcomes[index]['error'] = 'PrecedingMessageFailed'
+
+        if max_workers > 1 and len(groups) > 1:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(groups))) as executor:
+                list(executor.map(send_group, groups.values()))
+        else:
+            for indexes in groups.values():
+                send_group(indexes)
+        return outcomes
+
+    @staticmethod
+    def _pack_batches(indexes, outcomes, batch_size):
+        batch, batch_bytes = [], 0
+        for index in indexes:
+            size = len(outcomes[index]['body'].encode('utf-8'))
+            if size > MAX_BATCH_BYTES:
+                # Skipping it would reorder the group, stop here instead
+                outcomes[index]['error'] = 'MessageTooLong'
+                break
+            if batch and (len(batch) == batch_size or batch_bytes + size > MAX_BATCH_BYTES):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(index)
+            batch_bytes += size
+        if batch:
+            yield batch
+
+    def _send_batch(self, indexes, outcomes, max_attempts):
+        """Sends one batch of a message group, returns True when every entry was sent"""
+        # Deduplication ids are kept across retries so FIFO drops duplicates of entries that did get through
+        entries = [{
+            'Id': str(index),
+            'MessageBody': outcomes[index]['body'],
+            'MessageGroupId': outcomes[index]['group_id'],
+            'MessageDeduplicationId': str(uuid.uuid1())
+        } for index in indexes]
+        for attempt in range(max_attempts):
+            response = self._sqs_client.send_message_batch(QueueUrl=self._message_queue.url, Entries=entries)
+            for successful in response.get('Successful', []):
+                outcome = outcomes[int(successful['Id'])]
+                outcome.update({'success': True, 'message_id': successful['MessageId'], 'error': None})
+            sender_faults = set()
+            for failed in response.get('Failed', []):
+                outcomes[int(failed['Id'])]['error'] = failed['Code']
+                if failed.get('SenderFault'):
+                    sender_faults.add(failed['Id'])
+            pending = [entry for entry in entries if not outcomes[int(entry['Id'])]['success']]
+            if not pending:
+                return True
+            # Retrying is only order safe when the failed entries are the tail of the batch
+            first_failed = entries.index(pending[0])
+            if len(pending) != len(entries) - first_failed or pending[0]['Id'] in sender_faults:
+                break
+            entries = pending
+            if attempt < max_attempts - 1:
+                self._logger.info('Retrying {} failed messages'.format(len(entries)))
+                time.sleep(backoff_delay(attempt))
+        self._logger.error('Failed to send message {} of group {}, stopping the group'.format(
+            pending[0]['Id'], pending[0]['MessageGroupId']))
+        return False
@@ -13,6 +13,7 @@
 ## common-pipLibrary repository can be leveraged
 ## to add external libraries as a layer if need be
 #######################################################
+import os
 import json
 
 #######################################################
@@ -35,37 +36,41 @@ class CustomTransform():
         logger.info("S3 Blueprint Light Transform initiated")
         
     def transform_object(self, bucket, key, team, dataset):
-        # Download S3 object locally to /tmp directory
-        # The s3_helper.download_object method
-        # returns the local path where the file was saved
-        local_path = s3_interface.download_object(bucket, key)
+        # Files are downloaded to a work directory under /tmp that is removed
+        # when the block exits, so warm containers do not accumulate them
+        with s3_interface.work_directory():
+            # Download S3 object locally to a unique work directory under /tmp
+            # The s3_helper.download_object method
+            # returns the local path where the file was saved
+            # (small objects can be kept in memory with mode=DOWNLOAD_MODE_BYTES)
+            local_path = s3_interface.download_object(bucket, key)
         
-        # Apply business business logic:
-        # Below example is opening a JSON file and
-        # extracting fields, then saving the file to 
-        # CSV locally and re-uploading to Stage bucket
+            # Apply business business logic:
+            # Below example is opening a JSON file and
+            # extracting fields, then saving the file to 
+            # CSV locally and re-uploading to Stage bucket
 
-        # Reading file locally
-        with open(local_path, 'r') as raw:
-                data = raw.read()
+            # Reading file locally
+            with open(local_path, 'r') as raw:
+                    data = raw.read()
         
-        json_data = json.loads(data)
+            json_data = json.loads(data)
         
-        # Saving file locally as CSV to /tmp after extracting fields of interest
-        output_path = "{}.csv".format(local_path.split('.')[0])
-        with open(output_path, "w") as write_file:
-            write_file.write('{}, {}, {}, {}, {}'.format(
-                json_data['id'], json_data['name'], json_data['recclass'],
-                json_data['reclong'], json_data['reclat'])
-            )
+            # Saving file locally as CSV to /tmp after extracting fields of interest
+            output_path = "{}.csv".format(os.path.splitext(local_path)[0])
+            with open(output_path, "w") as write_file:
+                write_file.write('{}, {}, {}, {}, {}'.format(
+                    json_data['id'], json_data['name'], json_data['recclass'],
+                    json_data['reclong'], json_data['reclat'])
+                )
 
-        # Uploading file to Stage bucket at appropriate path
-        # IMPORTANT: Build the output s3_path without the s3://stage-bucket/
-        s3_path = 'pre-stage/{}/{}/{}'.format(team, dataset, output_path.split('/')[2])
-        # IMPORTANT: Notice "stage_bucket" not "bucket"
-        s3_interface.upload_object(output_path, stage_bucket, s3_path)
-        # IMPORTANT S3 path(s) must be stored in a list
-        processed_keys = [s3_path]
+            # Uploading file to Stage bucket at appropriate path
+            # IMPORTANT: Build the output s3_path without the s3://stage-bucket/
+            s3_path = 'pre-stage/{}/{}/{}'.format(team, dataset, os.path.basename(output_path))
+            # IMPORTANT: Notice "stage_bucket" not "bucket"
+            s3_interface.upload_object(output_path, stage_bucket, s3_path)
+            # IMPORTANT S3 path(s) must be stored in a list
+            processed_keys = [s3_path]
 
         #######################################################
         ## IMPORTANT
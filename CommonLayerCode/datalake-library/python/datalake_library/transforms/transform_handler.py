@@ -8,6 +8,8 @@ logger = init_logger(__name__)
 
  
 class TransformHandler: 
+    _dynamo_interface = None
+
     def __init__(self): 
         logger.info("Transformation Handler initiated") 
  
@@ -94,7 +96,12 @@ class TransformHandler:
         return response 
  
     def get_transform_info(self, dataset):
-        dynamo_config = DynamoConfiguration()
-        dynamo_interface = DynamoInterface(dynamo_config)      
-        return dynamo_interface.get_transform_table_item(dataset)['transforms']
+        return self._get_dynamo_interface().get_transform_table_item(dataset)['transforms']
+
+    @classmethod
+    def _get_dynamo_interface(cls):
+        # Built once per container, mapping items themselves are cached by DynamoInterface
+        if cls._dynamo_interface is None:
+            cls._dynamo_interface = DynamoInterface(DynamoConfiguration())
+        return cls._dynamo_interface
  
\ No newline at end of file